@@ -5,43 +5,881 @@
 # Developed by Jeremy Swancoat
 # Updated for Indigo 2023 (Python 3) by Joe Keenan (FlyingDiver)
 
+import re
+import json
+import array
 import time
+import logging
+import logging.handlers
+import random
+import heapq
+import queue
+import itertools
+import threading
+import contextlib
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
 import serial
 import requests
 import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# Retry serial port interruptions:
+# Retry serial port interruptions: reconnect attempts are spaced by exponential backoff from kReconnectFirst up to
+# kReconnectLongest seconds, each delay randomized by +/- kReconnectJitter. After kSerialRetry failed attempts in a row
+# further failures are only logged at debug level.
 kSerialRetry = 5
+kReconnectFirst = 0.5
+kReconnectLongest = 60
+kReconnectJitter = 0.25
+
+# Seconds a command may wait in the queue during a connection outage before it's dropped rather than sent late, and
+# how long an outage may last before every device is re-queried (shorter outages only re-query circuits with
+# commands that were lost or dropped)
+kCommandTTL = 60
+kStaleOutage = 5
+
+# Autelis HTTP session: (connect, read) timeouts in seconds, retry count and backoff factor for failed requests
+kAutelisTimeout = (3.05, 10)
+kAutelisRetries = 3
+kAutelisBackoff = 0.5
+
+# Number of worker threads fetching and parsing Autelis documents in the background
+kPollWorkers = 2
+
+# Bytes read per chunk when streaming Autelis documents, and the sections decoded from each document
+kAutelisChunk = 1024
+kAutelisSections = {
+    "status": ("system", "temp"),
+    "chem": ("chlor",),
+    "names": ("equipment",)
+}
+
+# Push-first Autelis mode: while the socket is connected, sections are polled over HTTP no more often than this
+# safety-net interval (seconds). kStreamSections maps values pushed on the socket to the status.xml section holding
+# them; a change to kReconcileCodes also affects values only status.xml carries (heater on/off status), so it brings
+# the next status poll forward.
+kPushSafetyNet = 15 * 60
+kStreamSections = {
+    "POOLHT": "temp", "SPAHT": "temp", "POOLSP": "temp", "SPASP": "temp",
+    "POOLTMP": "temp", "SPATMP": "temp", "AIRTMP": "temp"
+}
+kReconcileCodes = ("POOLHT", "SPAHT", "POOL", "SPA")
+
+# Least seconds between the starts of two Autelis HTTP commands (lights, chlorinator); only one is sent at a time
+kAutelisCommandInterval = 0.5
+
+# Adaptive Autelis polling: fastest interval for a section whose values are changing, how far an unchanged section
+# backs off beyond its configured interval, and how soon after a command the affected documents are polled (seconds)
+kPollFastest = 20
+kPollBackoff = 4
+kPollAfterCommand = 3
+
+# Latency samples kept per timing for the p50/p95/p99 figures, and seconds between metric updates on the system device
+kMetricSamples = 256
+kMetricsInterval = 60
+
+# Command priorities (lower goes first) and the most commands written to the interface per loop pass
+kPriorityAction = 0
+kPriorityQuery = 1
+kCommandsPerTick = 5
+
+# Commands allowed in flight at once, seconds to wait for the matching "!00" reply, and resends before giving up
+kPipelineDepth = 4
+kCommandTimeout = 2.0
+kCommandRetries = 2
+
+# Longest the concurrent thread blocks waiting for an event when no timer is due sooner (seconds)
+kIdleWait = 1.0
+
+# iLink / Autelis socket frames: status replies ("!00 AUX1 = 1", "!00 AUX1=1") and errors ("?...")
+kStatusFrame = re.compile(r"^!00\s+(\w+)\s*=\s*(\S+)")
+kErrorFrame = re.compile(r"^\?(.*)")
+
+# Seconds the circuit names discovered from names.xml are trusted before they're fetched again, and the names the panel
+# gives circuits that aren't in use
+kNamesTTL = 24 * 3600
+kUnusedNames = ("", "NOT USED")
+
+# Seconds between checks that every controller's I/O thread is still running, and the prop keys the plugin writes
+# to a controller device itself (which must not restart its connection)
+kSuperviseInterval = 5
+# Seconds stop() waits for a controller thread to finish its current pass before closing what it uses
+kStopWait = 5
+kCachedProps = ("circuitNames", "stateSnapshot")
+# Settings entered as numbers (zero or more), checked by the config dialogs and read with prefNumber
+kNumericPrefs = ("logRepeatWindow", "warmStartAge", "confirmTimeout", "snapshotAge")
+
+# Seconds without a new deviceStartComm before the collected startup queries are sent as one batch
+kSyncSettle = 0.5
+
+# Default seconds within which a message identical to the last one from the same place about the same subject is
+# dropped, and how many such places the check remembers before forgetting the ones outside the window
+kLogRepeatWindow = 60
+kLogRecent = 1024
+# Seconds the log writer waits after the first record of a burst, to write the whole burst in one go
+kLogLinger = 0.05
+
+# Readings kept as telemetry history: (series, circuit code, state, seconds between samples, window in seconds).
+# Each series holds at most window / interval samples; the rolling statistics cover the window.
+kHistorySeries = (
+    ("poolTemp", "POOLHT", "temperatureInput1", 60, 2 * 3600),
+    ("spaTemp", "SPAHT", "temperatureInput1", 30, 30 * 60),
+    ("airTemp", "SYSTEM", "airtemp", 300, 24 * 3600),
+    ("solarTemp", "SYSTEM", "solartemp", 60, 3600),
+    ("salt", "SYSTEM", "salt", 3600, 7 * 24 * 3600),
+    ("chlorOutput", "SYSTEM", "pool_chlor", 3600, 7 * 24 * 3600),
+)
+# Slowest temperature rise (degrees per hour) from which a heat-up ETA is estimated
+kHeatRateMin = 0.2
 
 
 ##################################################################################################
-class Plugin(indigo.PluginBase):
+def prefNumber(prefs, key, default):
+    # A numeric setting (see kNumericPrefs), or default if it's missing, blank, negative or not a number.
+    try:
+        value = float(prefs.get(key, default))
+    except (TypeError, ValueError):
+        return default
+    return value if value >= 0 else default
 
-    ##############################################################################################
-    # Required Methods
-    ##############################################################################################
-    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
-        indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
-        if 'showDebugInfo' in pluginPrefs:
-            self.debug = pluginPrefs['showDebugInfo']
+
+##################################################################################################
+def parseAutelisStream(chunks, sections, onSection=None):
+    # Incrementally parse an Autelis XML document from an iterable of byte chunks, as they arrive.
+    # Only the named top-level sections are decoded, into {tag: text} dicts, and each is passed to onSection as soon as
+    # its closing tag has been read. Every element is dropped once handled, so memory stays flat however big the
+    # document. Returns {section: {tag: text}}.
+    parser = ET.XMLPullParser(events=("start", "end"))
+    decoded = {}
+    root = None
+    depth = 0
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            parser.close()
         else:
-            self.debug = False
+            parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                if elem.tag in sections:
+                    values = {child.tag: child.text for child in elem}
+                    decoded[elem.tag] = values
+                    if onSection is not None:
+                        onSection(elem.tag, values)
+                root.clear()
+    return decoded
+
+
+##################################################################################################
+class Metrics(object):
+    # Counters and latency timings for the plugin's hot paths. Each timing keeps only its last kMetricSamples values,
+    # so memory stays fixed however long the plugin runs, and the percentiles reflect recent behaviour.
+
+    def __init__(self, samples=kMetricSamples):
+        self.samples = samples
+        self.counters = collections.Counter()
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.timings:
+                self.timings[name] = collections.deque(maxlen=self.samples)
+            self.timings[name].append(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def percentiles(self, name):
+        # (p50, p95, p99) in seconds over the recent samples, or None if nothing has been recorded.
+        with self.lock:
+            values = sorted(self.timings.get(name, ()))
+        if not values:
+            return None
+        return tuple(values[min(int(len(values) * pct), len(values) - 1)] for pct in (0.50, 0.95, 0.99))
+
+    def summary(self):
+        with self.lock:
+            counters = dict(self.counters)
+            names = sorted(self.timings)
+        lines = [f"{name}: {value}" for name, value in sorted(counters.items())]
+        for name in names:
+            p50, p95, p99 = self.percentiles(name)
+            lines.append(f"{name}: p50 {p50 * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms")
+        return lines
+
+
+##################################################################################################
+class History(object):
+    # Timestamped samples of one reading in a fixed-size ring, with rolling min, max, mean and slope over a time
+    # window. Times and values live in two preallocated arrays. The sums behind mean and slope are adjusted as samples
+    # enter and leave, and min/max come from monotonic queues of sample numbers, so adding a sample and reading the
+    # statistics never rescan the ring.
+
+    def __init__(self, interval, window):
+        self.interval = interval
+        self.window = window
+        self.capacity = int(window // interval) + 1
+        self.times = array.array('d', [0.0]) * self.capacity
+        self.values = array.array('d', [0.0]) * self.capacity
+        self.first = 0      # sample number of the oldest sample kept
+        self.next = 0       # sample number the next sample gets
+        self.lows = collections.deque()     # sample numbers whose values increase: lows[0] is the minimum
+        self.highs = collections.deque()    # sample numbers whose values decrease: highs[0] is the maximum
+        # Sums over the kept samples for mean and least-squares slope. Times are taken relative to origin, which
+        # rebase() moves up (recomputing the sums exactly) once per pass round the ring, so rounding can't build up.
+        self.origin = 0.0
+        self.rebased = 0
+        self.sumT = self.sumV = self.sumTT = self.sumTV = 0.0
+
+    def __len__(self):
+        return self.next - self.first
+
+    def add(self, when, value):
+        # Record a sample, unless the previous one is less than the sampling interval old. Returns True if recorded.
+        if self.next > self.first and when - self.times[(self.next - 1) % self.capacity] < self.interval:
+            return False
+        self.expire(when)
+        if len(self) == self.capacity:
+            self.drop()
+        elif len(self) == 0:
+            self.origin = when
+            self.sumT = self.sumV = self.sumTT = self.sumTV = 0.0
+            self.rebased = self.next
+        index = self.next % self.capacity
+        self.times[index] = when
+        self.values[index] = value
+        t = when - self.origin
+        self.sumT += t
+        self.sumV += value
+        self.sumTT += t * t
+        self.sumTV += t * value
+        while self.lows and self.values[self.lows[-1] % self.capacity] >= value:
+            self.lows.pop()
+        self.lows.append(self.next)
+        while self.highs and self.values[self.highs[-1] % self.capacity] <= value:
+            self.highs.pop()
+        self.highs.append(self.next)
+        self.next += 1
+        if self.next - self.rebased >= self.capacity:
+            self.rebase()
+        return True
+
+    def drop(self):
+        # Forget the oldest sample.
+        index = self.first % self.capacity
+        t = self.times[index] - self.origin
+        value = self.values[index]
+        self.sumT -= t
+        self.sumV -= value
+        self.sumTT -= t * t
+        self.sumTV -= t * value
+        if self.lows[0] == self.first:
+            self.lows.popleft()
+        if self.highs[0] == self.first:
+            self.highs.popleft()
+        self.first += 1
+
+    def expire(self, now):
+        while self.next > self.first and self.times[self.first % self.capacity] < now - self.window:
+            self.drop()
+
+    def rebase(self):
+        self.origin = self.times[self.first % self.capacity] if len(self) else 0.0
+        self.sumT = self.sumV = self.sumTT = self.sumTV = 0.0
+        for number in range(self.first, self.next):
+            index = number % self.capacity
+            t = self.times[index] - self.origin
+            value = self.values[index]
+            self.sumT += t
+            self.sumV += value
+            self.sumTT += t * t
+            self.sumTV += t * value
+        self.rebased = self.next
+
+    def stats(self, now):
+        # (samples, min, max, mean, slope per second or None) over the window ending now, or None without samples.
+        self.expire(now)
+        count = len(self)
+        if count == 0:
+            return None
+        slope = None
+        spread = count * self.sumTT - self.sumT * self.sumT
+        if count > 1 and spread > 0:
+            slope = (count * self.sumTV - self.sumT * self.sumV) / spread
+        return (count, self.values[self.lows[0] % self.capacity], self.values[self.highs[0] % self.capacity],
+                self.sumV / count, slope)
+
+
+##################################################################################################
+class AdaptivePoller(object):
+    # Keeps a separate poll interval for each decoded Autelis section. A section whose values changed is polled again
+    # at the fastest rate; every unchanged poll doubles its interval, up to kPollBackoff times the configured one.
+    # Sections configured as pushed (kept current by socket notifications) stay at their configured interval.
+    # expedite() brings polls forward after a command. Counts polls made against a fixed schedule at the
+    # configured intervals, to report the polls saved.
+
+    def __init__(self):
+        self.sections = {}
+        self.lock = threading.Lock()
+
+    def configure(self, name, baseline, now, pushed=False):
+        # baseline is the configured interval; keeps the section's counters if it's already known
+        with self.lock:
+            section = self.sections.setdefault(name, {'polls': 0, 'since': now, 'nextDue': now})
+            section['baseline'] = baseline
+            section['interval'] = baseline
+            section['pushed'] = pushed
+            section['nextDue'] = min(section['nextDue'], now + baseline)
+
+    def due(self, names, now):
+        with self.lock:
+            return any(self.sections[name]['nextDue'] <= now for name in names if name in self.sections)
+
+    def polled(self, names, now):
+        with self.lock:
+            for name in names:
+                if name in self.sections:
+                    self.sections[name]['polls'] += 1
+                    self.sections[name]['nextDue'] = now + self.sections[name]['interval']
+
+    def observed(self, name, changed, now):
+        with self.lock:
+            section = self.sections.get(name)
+            if section is None or section['pushed']:
+                return
+            if changed:
+                section['interval'] = min(kPollFastest, section['baseline'])
+            else:
+                section['interval'] = min(section['interval'] * 2, section['baseline'] * kPollBackoff)
+            section['nextDue'] = now + section['interval']
+
+    def expedite(self, now, delay=kPollAfterCommand, names=None):
+        with self.lock:
+            for name, section in self.sections.items():
+                if names is not None and name not in names:
+                    continue
+                if not section['pushed']:
+                    section['interval'] = min(kPollFastest, section['baseline'])
+                section['nextDue'] = min(section['nextDue'], now + delay)
+
+    def nextDue(self):
+        with self.lock:
+            if not self.sections:
+                return None
+            return min(section['nextDue'] for section in self.sections.values())
+
+    def stats(self, now):
+        # {section: (polls made, polls a fixed schedule would have made, current interval)}
+        with self.lock:
+            return {name: (section['polls'], int((now - section['since']) / section['baseline']) + 1, section['interval'])
+                    for name, section in self.sections.items()}
+
+
+##################################################################################################
+class CommandScheduler(object):
+    # Thread-safe priority queue of commands waiting to be written to the Pentair interface.
+    # User actions go ahead of status queries ("X ?"), commands of equal priority keep their order,
+    # and a query that is already waiting to be sent is not queued a second time. An action for a circuit code that
+    # already has one waiting replaces it in place, so repeated set point bumps send only the last value.
+
+    def __init__(self, wake=None):
+        self.heap = []
+        self.queries = set()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.wake = wake    # called after each new command, so the writer can send it right away
+
+    def __len__(self):
+        with self.lock:
+            return len(self.heap)
+
+    def put(self, command, priority=None, queued=None):
+        # Returns False if the command was merged into a pending query, or replaced a pending action.
+        # queued is the time the command was first queued, for commands put back after a lost connection.
+        if priority is None:
+            priority = kPriorityQuery if command.endswith("?") else kPriorityAction
+        with self.lock:
+            if priority == kPriorityQuery:
+                if command in self.queries:
+                    return False
+                self.queries.add(command)
+            else:
+                code = ProtocolEngine.codeFor(command)
+                for index, (waiting, seq, pending, pendingQueued) in enumerate(self.heap):
+                    if waiting == priority and code is not None and ProtocolEngine.codeFor(pending) == code:
+                        if queued is None:
+                            # a command put back after a lost connection is older than the one waiting
+                            self.heap[index] = (waiting, seq, command, pendingQueued)
+                        return False
+            heapq.heappush(self.heap, (priority, next(self.sequence), command, queued or time.time()))
+        if self.wake is not None:
+            self.wake()
+        return True
+
+    def get(self, limit=1, busy=None):
+        # Remove and return up to limit (command, time queued) pairs, highest priority first.
+        # Commands whose circuit code is in busy are skipped and stay queued in their original position.
+        commands = []
+        skipped = []
+        with self.lock:
+            while self.heap and len(commands) < limit:
+                entry = heapq.heappop(self.heap)
+                priority, seq, command, queued = entry
+                if busy and ProtocolEngine.codeFor(command) in busy:
+                    skipped.append(entry)
+                    continue
+                if priority == kPriorityQuery:
+                    self.queries.discard(command)
+                commands.append((command, queued))
+            for entry in skipped:
+                heapq.heappush(self.heap, entry)
+        return commands
+
+    def ready(self, busy=None):
+        # True if get() would return a command: something is queued whose circuit code isn't in busy.
+        with self.lock:
+            return any(not busy or ProtocolEngine.codeFor(entry[2]) not in busy for entry in self.heap)
+
+    def expire(self, ttl, now):
+        # Remove and return the commands that have been waiting longer than ttl seconds.
+        with self.lock:
+            expired = [entry[2] for entry in self.heap if now - entry[3] > ttl]
+            if expired:
+                self.heap = [entry for entry in self.heap if now - entry[3] <= ttl]
+                heapq.heapify(self.heap)
+                self.queries.difference_update(expired)
+        return expired
+
+    def clear(self):
+        with self.lock:
+            self.heap = []
+            self.queries = set()
+
+
+##################################################################################################
+class AutelisDispatcher(object):
+    # Queue of Autelis HTTP commands, sent by the poll workers one at a time and at most one per 'interval' seconds.
+    # A collapsing command (a setting, like a chlorinator level) for the same target (group, circuit, parameter) as
+    # one still waiting replaces its value, so only the latest is sent; other commands (lights on/off, light shows)
+    # are all sent, in order. Each caller gets a Future resolving to (success, seconds).
+
+    def __init__(self, interval=kAutelisCommandInterval, wake=None):
+        self.interval = interval
+        # target, or (target, sequence number) for commands that don't collapse -> [target, value, futures, time queued]
+        self.pending = collections.OrderedDict()
+        self.sequence = itertools.count()
+        self.inFlight = False
+        self.lastSent = 0
+        self.lock = threading.Lock()
+        self.wake = wake
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def put(self, comGroup, circuit, param, value, collapse=False):
+        # Returns (future, whether the command replaced one still waiting).
+        future = Future()
+        target = (comGroup, circuit, param)
+        key = target if collapse else (target, next(self.sequence))
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = [target, value, [future], time.time()]
+            else:
+                entry[1] = value
+                entry[2].append(future)
+        if self.wake is not None:
+            self.wake()
+        return future, entry is not None
+
+    def next(self, now):
+        # Take the next command to send as (target, value, futures, time queued), or None if nothing is waiting,
+        # a command is still in flight or the rate limit says to wait.
+        with self.lock:
+            if self.inFlight or not self.pending or now < self.lastSent + self.interval:
+                return None
+            key, (target, value, futures, queued) = self.pending.popitem(last=False)
+            self.inFlight = True
+            self.lastSent = now
+        return target, value, futures, queued
+
+    def done(self):
+        with self.lock:
+            self.inFlight = False
+        if self.wake is not None:
+            self.wake()
+
+    def nextDue(self):
+        # When the next waiting command may be sent, or None if it has to wait for the one in flight (or none waits).
+        with self.lock:
+            if self.inFlight or not self.pending:
+                return None
+            return self.lastSent + self.interval
+
+    def clear(self):
+        # Drop the waiting commands; whoever waits on them sees a cancelled Future.
+        with self.lock:
+            pending = self.pending
+            self.pending = collections.OrderedDict()
+            self.inFlight = False
+        for target, value, futures, queued in pending.values():
+            for future in futures:
+                future.cancel()
+
+
+##################################################################################################
+class ProtocolEngine(object):
+    # Correlates commands written to the interface with the "!00 <code> = <value>" replies they cause.
+    # Up to 'depth' commands may be outstanding at once, but only one per circuit code, since replies carry
+    # nothing but the code. Commands that never produce a reply (ALLLIGHTS, Intellibrite modes) are not tracked.
+
+    commandPattern = re.compile(r"^([A-Z0-9_]+)\s*(=|\?)")
+    untracked = ("ALLLIGHTS",)
+
+    def __init__(self, depth=kPipelineDepth, timeout=kCommandTimeout, retries=kCommandRetries):
+        self.depth = depth
+        self.timeout = timeout
+        self.retries = retries
+        self.outstanding = {}   # code -> [command, time sent, attempts]
+
+    @classmethod
+    def codeFor(cls, command):
+        # The circuit code a command's reply will carry, or None if no reply is expected.
+        match = cls.commandPattern.match(command)
+        if match is None or match.group(1) in cls.untracked:
+            return None
+        return match.group(1)
+
+    def busy(self):
+        return set(self.outstanding)
+
+    def room(self):
+        return max(self.depth - len(self.outstanding), 0)
+
+    def sent(self, command, now):
+        code = self.codeFor(command)
+        if code is None:
+            return
+        if code in self.outstanding:
+            self.outstanding[code][1] = now
+            self.outstanding[code][2] += 1
+        else:
+            self.outstanding[code] = [command, now, 1]
+
+    def matched(self, code, now):
+        # Complete the command waiting on code. Returns (command, round trip seconds), or None if nothing was waiting.
+        entry = self.outstanding.pop(code, None)
+        if entry is None:
+            return None
+        return entry[0], now - entry[1]
+
+    def failed(self):
+        # The interface rejected a command; blame the oldest one in flight. Returns its command string or None.
+        if not self.outstanding:
+            return None
+        code = min(self.outstanding, key=lambda c: self.outstanding[c][1])
+        return self.outstanding.pop(code)[0]
+
+    def nextDeadline(self):
+        # When the oldest reply in flight becomes overdue, or None if nothing is in flight.
+        if not self.outstanding:
+            return None
+        return min(sentTime for command, sentTime, attempts in self.outstanding.values()) + self.timeout
+
+    def expired(self, now):
+        # Returns (commands to resend, commands that ran out of attempts) among those whose reply is overdue.
+        resend = []
+        dropped = []
+        for code, (command, sentTime, attempts) in list(self.outstanding.items()):
+            if now - sentTime < self.timeout:
+                continue
+            if attempts > self.retries:
+                del self.outstanding[code]
+                dropped.append(command)
+            else:
+                resend.append(command)
+        return resend, dropped
+
+    def abandon(self):
+        # The connection was lost: forget every command in flight. Returns [(command, time sent)].
+        lost = [(command, sentTime) for command, sentTime, attempts in self.outstanding.values()]
+        self.outstanding = {}
+        return lost
+
+    def clear(self):
+        self.outstanding = {}
+
+
+##################################################################################################
+class DeviceShadow(object):
+    # In-process copy of a managed device: id, name, props and last-known states. Lets the parsing hot path look up
+    # and compare state without fetching a full device copy from the server. 'dev' is kept only to call
+    # updateStatesOnServer, which needs nothing but the device id.
+
+    def __init__(self, dev):
+        self.refresh(dev)
+
+    def refresh(self, dev):
+        self.dev = dev
+        self.id = dev.id
+        self.name = dev.name
+        self.deviceTypeId = dev.deviceTypeId
+        self.props = dict(dev.pluginProps)
+        self.states = dict(dev.states)
+
+
+##################################################################################################
+class ControllerLog(logging.LoggerAdapter):
+    # Prefixes a controller's log messages with its name, so messages from several panels can be told apart.
+
+    def process(self, msg, kwargs):
+        # msg may be a %-style format, with its arguments applied later, so a '%' in the name must be escaped
+        return self.extra['name'].replace("%", "%%") + ": " + str(msg), kwargs
+
+
+##################################################################################################
+class RepeatFilter(logging.Filter):
+    # Drops a debug or info message identical to the one logged just before it from the same line about the same
+    # subject (all its arguments but the last, usually the value) within window seconds, so values reported unchanged
+    # on every poll don't flood the log. Only consecutive repeats are dropped: on, off, on is logged in full. The next
+    # message from that line says how many repeats were dropped. Warnings and errors always get through.
+
+    def __init__(self, window, metrics):
+        super().__init__()
+        self.window = window
+        self.metrics = metrics
+        self.recent = {}    # (file, line, subject) -> [last message, time logged, repeats dropped since]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.window <= 0 or record.levelno > logging.INFO:
+            return True
+        args = record.args
+        try:
+            key = (record.pathname, record.lineno, args[:-1] if isinstance(args, tuple) else None)
+            hash(key)
+        except TypeError:
+            return True
+        message = record.getMessage()
+        with self.lock:
+            entry = self.recent.get(key)
+            if entry is not None and entry[0] == message and record.created - entry[1] < self.window:
+                entry[2] += 1
+                dropped = -1
+            else:
+                dropped = entry[2] if entry is not None else 0
+                self.recent[key] = [message, record.created, 0]
+                if len(self.recent) > kLogRecent:
+                    self.recent = {key: entry for key, entry in self.recent.items()
+                                   if record.created - entry[1] < self.window}
+        if dropped < 0:
+            self.metrics.count("log.suppressed")
+            return False
+        if dropped > 0:
+            record.msg = f"{message} (previous message repeated {dropped} more times)"
+            record.args = None
+        return True
+
+
+##################################################################################################
+class LogQueueHandler(logging.handlers.QueueHandler):
+    # Hands log records to the writer thread. Counts what is logged and how long each logging thread spent on it;
+    # take() collects that time for the calling thread, so the controller loop can report it per pass.
+
+    def __init__(self, logQueue, metrics):
+        super().__init__(logQueue)
+        self.metrics = metrics
+        self.spent = threading.local()
+
+    def handle(self, record):
+        start = time.perf_counter()
+        try:
+            return super().handle(record)
+        finally:
+            self.spent.seconds = getattr(self.spent, "seconds", 0.0) + time.perf_counter() - start
+
+    def prepare(self, record):
+        # Records are not shared, so unlike QueueHandler.prepare don't copy them; just resolve the message once.
+        if record.exc_info or record.stack_info:
+            return super().prepare(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self.metrics.count("log.records")
+        self.metrics.count("log.bytes", len(record.msg))
+        super().enqueue(record)
+
+    def take(self):
+        seconds = getattr(self.spent, "seconds", 0.0)
+        self.spent.seconds = 0.0
+        return seconds
+
+
+##################################################################################################
+class LogWriter(object):
+    # The writer thread: passes queued records to Indigo's own handlers. It waits kLogLinger after the first record of
+    # a burst and then writes everything queued, so a burst costs the logging threads one wake-up instead of one per
+    # record (a queue put only wakes the writer while it is blocked in get).
+
+    def __init__(self, logQueue, metrics, handlers):
+        self.queue = logQueue
+        self.metrics = metrics
+        self.handlers = handlers
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="PentairLog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Write out what is queued, then end the thread.
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            if batch[0] is not None:
+                time.sleep(kLogLinger)
+            with contextlib.suppress(queue.Empty):
+                while True:
+                    batch.append(self.queue.get_nowait())
+            with self.metrics.timer("log.write"):
+                for record in batch:
+                    if record is None:
+                        running = False
+                        continue
+                    for handler in self.handlers:
+                        if record.levelno >= handler.level:
+                            handler.handle(record)
+
+
+##################################################################################################
+class Controller(object):
+    # One Pentair panel: its iLink or Autelis connection, command scheduler, Autelis poll workers and the devices it
+    # serves, keyed by circuit code. Every controller runs its own I/O thread (run), so a slow or disconnected panel
+    # never holds up another. The default controller is configured in the plugin prefs, any others by 'controller'
+    # devices whose props hold the same settings.
+
+    def __init__(self, plugin, controllerId, name, prefs, dev=None):
+        self.plugin = plugin
+        self.id = controllerId
+        self.name = name
+        self.dev = dev              # the 'controller' device, None for the default controller
+        self.pluginPrefs = prefs    # the plugin prefs, or the controller device's props
+        self.logger = plugin.logger if dev is None else ControllerLog(plugin.logger, {'name': name})
+        self.thread = None
+        self.running = False
         self.conn = None
         self.portEnabled = False
-        self.commQueue = []
-        self.circuit_dev = {}
-        self.logTemps = False
+
+        # Serial connection supervision. While the connection is down, commands keep queuing (up to kCommandTTL) and
+        # the controller thread reconnects at reconnectAt, backing off after every failed attempt.
+        self.serialUrl = ""
+        self.reconnectAt = None
+        self.reconnectAttempts = 0
+        self.outageStarted = None
+        self.outageCircuits = set()
+
+        # Everything the controller thread reacts to arrives on this queue: frames assembled by the serial reader
+        # thread, decoded Autelis sections and finished fetches from the poll workers, and wake-ups when a command
+        # is queued. The thread blocks on it until an event arrives or the next timer is due.
+        self.events = queue.Queue()
+        self.commQueue = CommandScheduler(self.wake)
+        self.autelisCommands = AutelisDispatcher(wake=self.wake)
+        self.metrics = Metrics()
+        self.metricsUpdated = time.time()
+        self.protocol = ProtocolEngine()
+        self.circuit_dev = {}   # circuit code -> DeviceShadow
         self.autelisIP = '0'
-        self.system_names = {}
+        self.system_names = {}     # circuit code -> name from names.xml, see autelisProcessNames
+        self.namesFetched = 0
+        self.namesRefreshing = False
+        self.autelisSession = None
         self.modelList = (
             "i5p3", "i7p3", "i9p3", "i5p3S", "i9p3S", "i10p3D", "unknown", "unknown", "unknown", "unknown", "unknown", "unknown", "unknown",
             "unknown", "unknown", "EasyTouch 8")
         self.opMode = ("auto", "service")
         self.okErr = ("ok", "error")
         self.curTemp = 77
-        self.next_refresh = time.time()
-        self.refreshTemp = None
-        self.refreshChem = None
+        self.poller = AdaptivePoller()
+
+        # Shared snapshots of the Autelis XML documents, keyed by document name ("status", "chem").  Each entry holds
+        # the decoded sections and the validators needed for a conditional fetch.  autelisDecoded remembers the values
+        # each section decoder last handled, so an unchanged section is never decoded twice.
+        self.autelisSnapshots = {}
+        self.autelisDecoded = {}
+        self.snapshotAge = 10.0
+        self.snapshotLock = threading.Lock()
+
+        # Autelis documents are fetched by a small worker pool so slow HTTP never holds up the serial/command loop.
+        # Decoded sections and finished fetches are handed back to runConcurrentThread through the event queue.
+        # pollsInFlight maps each document being fetched to whether its sections must be delivered again when done.
+        self.pollExecutor = None
+        self.pollsInFlight = {}
+        self.pollLock = threading.Lock()
+
+        # Startup state sync. deviceStartComm only collects what each device needs; once device starts settle the
+        # loop sends one deduplicated, ordered batch and times how long it takes until every reply has arrived.
+        self.syncQueries = set()
+        self.syncDocuments = set()
+        self.syncDevices = 0
+        self.syncLastAdded = 0
+        self.syncStarted = None
+        self.syncWaiting = set()
+        self.syncDuration = None
+        self.syncSkipped = 0
+        self.syncLock = threading.Lock()
+
+        # Warm start. replied maps each reported code to (time, circuit code, state, value) of the panel's last reply.
+        # stop() saves it, with the Autelis document snapshots, in the 'stateSnapshot' pref and start() restores them,
+        # so after a quick restart a device is only re-queried for values older than warmStartAge (and the documents
+        # are fetched conditionally, i.e. only transferred if the panel's status has changed).
+        self.replied = {}
+        self.source = None
+        self.warmStartAge = prefNumber(self.pluginPrefs, 'warmStartAge', 300)
+
+        # Changed state values waiting to be written, per circuit code. Decoders only queue values that differ from the
+        # device shadow's states; flushStates writes them in one call per device.
+        self.pendingStates = {}
+        self.stateLock = threading.Lock()
+
+        # Optimistic mode: actions show their expected result at once, with the device's 'pending' state set, until the
+        # panel reports the value. optimistic maps (circuit code, state) to [expected value, value before the action,
+        # latest conflicting value reported, confirmation deadline]; anything unconfirmed by then is rolled back.
+        self.optimisticMode = False
+        self.confirmTimeout = 30.0
+        self.pushUpdates = False
+        self.optimistic = {}
+
+        # Telemetry history of the readings in kHistorySeries, fed by queueState and guarded by stateLock. The derived
+        # states (temperature trend, heat-up ETA, salt trend) are published with the metrics, see publishHistory.
+        self.history = {}
+        self.historyKeys = {}
+        for series, circuitcode, key, interval, window in kHistorySeries:
+            self.history[series] = History(interval, window)
+            self.historyKeys[(circuitcode, key)] = series
 
         # Map of Pentair-style Circuit Codes and a quad-tuple indicating what device code the device will be found under,
         # (USUALLY, but not always, the same as the reported code)
@@ -58,6 +896,12 @@ class Plugin(indigo.PluginBase):
             "OPMODE": ("SYSTEM", "opmode", " Operation Mode", "ilinkOpmode")
         }
 
+        # Compiled from pentairStateMap plus the POOL, SPA and AUX1-AUX50 circuits by buildIlinkDecoders(), since the
+        # heater mode format depends on the interface. Maps the reported code to
+        # (normalized code, device circuit code, state, log suffix, processing type, value decoder).
+        self.ilinkDecoders = {}
+        self.buildIlinkDecoders()
+
         # Map of Autelis' variable names to the states used in the 'system' device type.
         self.autelisStateMap = {
             "runstate": "readystate",
@@ -94,248 +938,794 @@ class Plugin(indigo.PluginBase):
            "soltemp": ("SYSTEM", "solartemp")
         }
 
-    ##############################################################################################
-    # Non-Required Methods (but still defined by Indigo)
-    ##############################################################################################
-    def startup(self):
+        # loaded now rather than in start(), since devices may be added to a controller before it starts
+        self.loadSnapshot()
+
+    def start(self):
         # startup process for the serial device. Other than open the serial port, there should be none really. It just runs.
+        # Also (re)applies the settings and makes sure the controller thread is running. A running thread applies
+        # them itself (a "restart" event), so the connection and poll workers are never replaced under it.
         self.logger.debug("Startup Called")
+        if self.running and self.thread is not None and self.thread.is_alive():
+            self.events.put(("restart",))
+            return
+        self.configure()
+        self.startThread()
 
+    def configure(self):
+        # Apply the settings: reopen the connection, set up polling and the poll workers. Runs on the controller
+        # thread, or before it is started.
         if self.conn is None:
             pass
         else:
-            self.conn.close()
+            # clear self.conn first, so the reader thread knows the close is deliberate
+            conn = self.conn
+            self.conn = None
+            conn.close()
         self.portEnabled = False
+        self.protocol.clear()
+        self.buildIlinkDecoders()
 
-        serialUrl = self.getSerialPortUrl(self.pluginPrefs, "serialport")
+        self.snapshotAge = prefNumber(self.pluginPrefs, 'snapshotAge', 10)
+        self.warmStartAge = prefNumber(self.pluginPrefs, 'warmStartAge', 300)
+        self.optimisticMode = bool(self.plugin.pluginPrefs.get('optimistic', False))
+        self.confirmTimeout = prefNumber(self.plugin.pluginPrefs, 'confirmTimeout', 30)
+        self.pushUpdates = bool(self.pluginPrefs.get('pushUpdates', False))
+        self.configurePolling()
+        self.autelisDecoded = {}
+        if self.autelisSession is not None:
+            self.autelisSession.close()
+        self.autelisSession = self.makeAutelisSession()
+        if self.pollExecutor is not None:
+            self.pollExecutor.shutdown(wait=False, cancel_futures=True)
+        self.pollExecutor = ThreadPoolExecutor(max_workers=kPollWorkers, thread_name_prefix="AutelisPoll")
+        with self.pollLock:
+            self.pollsInFlight = {}
+        self.autelisCommands.clear()
+        self.loadCircuitNames()
+
+        serialUrl = self.plugin.getSerialPortUrl(self.pluginPrefs, "serialport")
+        if self.connectionSource() != self.source:
+            # another panel connection: what we knew about the old one no longer applies
+            self.loadSnapshot()
         if 'interface' in self.pluginPrefs:
             if self.pluginPrefs['interface'] == 'autelis':
-                self.autelisIP = serialUrl[9:].split(":")[0]
+                # the web interface is on the socket's host, unless an 'autelisAddress' (host[:port]) is set
+                self.autelisIP = self.pluginPrefs.get('autelisAddress') or serialUrl[9:].split(":")[0]
                 self.logger.debug(f"Autelis IP Address: {self.autelisIP}")
+                self.circuitNames()
+        self.serialUrl = serialUrl
+        self.reconnectAt = None
+        self.reconnectAttempts = 0
+        self.outageStarted = None
+        self.outageCircuits = set()
         if serialUrl == "":
             pass
         else:
             self.logger.info(f"Serial Port URL is{serialUrl}")
-            self.conn = self.openSerial("Pentair Intellitouch", serialUrl, 9600, stopbits=1, timeout=0.5, writeTimeout=1)
+            if not self.openConnection():
+                self.connectionLost("could not open port")
+        self.publishHealth()
+
+    def startThread(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"Pentair-{self.name}", daemon=True)
+        self.thread.start()
+
+    def attach(self, dev):
+        # Take over the name and settings of this controller's device (at start, or after it was edited).
+        self.dev = dev
+        self.name = dev.name
+        self.pluginPrefs = dict(dev.pluginProps)
+        self.logger = ControllerLog(self.plugin.logger, {'name': dev.name})
+
+    def openConnection(self):
+        # Open the serial port and start its reader thread. Returns True if the port is open.
+        try:
+            self.conn = self.plugin.openSerial("Pentair Intellitouch", self.serialUrl, 9600, stopbits=1, timeout=0.5, writeTimeout=1)
+        except (serial.SerialException, OSError) as err:
+            self.logger.debug(f"Opening {self.serialUrl} failed: {err}")
+            self.conn = None
 
         if self.conn is not None:
             self.portEnabled = True
-            self.logger.info(f"Serial Port Open at {serialUrl}")
+            self.logger.info(f"Serial Port Open at {self.serialUrl}")
+            threading.Thread(target=self.serialReader, args=(self.conn,), name="PentairReader", daemon=True).start()
+            self.configurePolling()
+            self.publishHealth()
+        return self.conn is not None
 
-    def shutdown(self):
-        # close serial port here
-        self.logger.debug("Shutdown Called")
-        self.conn.close()
-        self.logger.info("Serial Port Closed")
+    def pushActive(self):
+        # True while Autelis updates arrive as socket notifications, with HTTP polls only as a safety net.
+        return self.pushUpdates and self.portEnabled and self.pluginPrefs.get('interface') == 'autelis'
 
-    def validateDeviceConfigUi(self, valuesDict, typeId, devId):
-        # Validate that appropriate selections were made in device creation / modification dialogs.
-        # Ensure that Zone is not already used
-        errorsDict = indigo.Dict()
-        circuit = valuesDict["circuitselect"]
-        self.logger.debug(f"Circuit Selected: {circuit}")
-        self.logger.debug("Validating Device")
-        if circuit in self.circuit_dev:
-            errorsDict["circuitselect"] = "Circuit Already Assigned to Device"
-        else:
-            self.logger.debug("Circuit Available")
+    def configurePolling(self):
+        # Set the Autelis section poll intervals from the prefs; in push mode they're stretched to the safety net.
+        now = time.time()
+        push = self.pushActive()
+        for name, pref, default in (("system", 'statusPoll', 5), ("temp", 'chemPoll', 2), ("chlor", 'chemPoll', 2)):
+            interval = 60 * float(self.pluginPrefs.get(pref, default))
+            if push:
+                interval = max(interval, kPushSafetyNet)
+            self.poller.configure(name, interval, now, pushed=push)
 
-        if len(errorsDict) > 0:
-            return False, valuesDict, errorsDict
-        return True, valuesDict
+    def stop(self):
+        # close serial port here, and end the controller thread. Its current pass is allowed to finish first, so the
+        # poll workers and connection aren't shut down while it's still using them.
+        self.logger.debug("Shutdown Called")
+        self.running = False
+        self.reconnectAt = None
+        self.wake()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(kStopWait)
+            if self.thread.is_alive():
+                self.logger.warning(f"Controller thread still busy after {kStopWait} seconds, stopping anyway")
+        self.saveSnapshot()
+        if self.pollExecutor is not None:
+            self.pollExecutor.shutdown(wait=False, cancel_futures=True)
+        if self.autelisSession is not None:
+            self.autelisSession.close()
+        if self.conn is not None:
+            # clear self.conn first, so the reader thread knows the close is deliberate
+            conn = self.conn
+            self.conn = None
+            self.portEnabled = False
+            conn.close()
+            self.logger.info("Serial Port Closed")
 
-    # This section creates entries and deletes entries in a dictionary of
-    # AUXx , dev in an effort help find devices simply by what zone they control.
-    def deviceStartComm(self, dev):
-        self.logger.debug("deviceStartComm called")
+    def addDevice(self, dev):
         circuitcode = dev.pluginProps["circuitselect"]
+        with self.stateLock:
+            self.circuit_dev[circuitcode] = DeviceShadow(dev)
+        self.logger.debug("Just added: " + circuitcode + " to circuitdev")
+        queries, documents = self.statusRequests(dev.deviceTypeId, circuitcode)
+        now = time.time()
+        stale = [query for query in queries if not self.isWarm(query, dev.states, now)]
+        self.addStartupSync(stale, documents, len(queries) - len(stale))
 
-        if not dev.address or dev.address == "":
-            newProps = dev.pluginProps
-            newProps.update({"address": circuitcode})
-            dev.replacePluginPropsOnServer(newProps)
+    def removeDevice(self, dev):
+        circuitcode = dev.pluginProps["circuitselect"]
+        with self.stateLock:
+            shadow = self.circuit_dev.get(circuitcode)
+            if shadow is not None and shadow.id == dev.id:
+                del self.circuit_dev[circuitcode]
+            self.pendingStates.pop(circuitcode, None)
+        self.logger.debug("Just deleted: " + circuitcode + " from circuitdev")
 
-        self.circuit_dev[dev.pluginProps["circuitselect"]] = dev.id
-        self.logger.debug("Just added: " + circuitcode + " to circuitdev")
-        if dev.deviceTypeId == "circuit":
-            self.commQueue.append(circuitcode + " ?")
-        elif dev.deviceTypeId == "heater":
+    def updateDevice(self, dev):
+        # Keep the device shadow in step with the server (name or props edited, states written by us or others).
+        with self.stateLock:
+            shadow = self.circuit_dev.get(dev.pluginProps.get("circuitselect"))
+            if shadow is not None and shadow.id == dev.id:
+                shadow.refresh(dev)
+
+    def savePref(self, key, value):
+        # Persist a value in this controller's settings: the plugin prefs, or the props of its controller device.
+        self.pluginPrefs[key] = value
+        if self.dev is not None and self.dev.id in indigo.devices:
+            # device objects are copies: start from the props on the server now, so a setting the user has edited
+            # since attach() isn't written back over
+            props = indigo.devices[self.dev.id].pluginProps
+            props[key] = value
+            self.dev.replacePluginPropsOnServer(props)
+
+    def connectionSource(self):
+        # Identifies the panel connection a state snapshot belongs to.
+        return f"{self.pluginPrefs.get('interface', '')} {self.plugin.getSerialPortUrl(self.pluginPrefs, 'serialport')}"
+
+    def loadSnapshot(self):
+        # Restore the replies and Autelis documents saved by the last stop(), if they came from the same connection.
+        self.source = self.connectionSource()
+        try:
+            saved = json.loads(self.pluginPrefs.get("stateSnapshot") or "{}")
+        except ValueError:
+            saved = {}
+        if saved.get("source") != self.source:
+            saved = {}
+        self.replied = {code: tuple(entry) for code, entry in saved.get("replies", {}).items()}
+        with self.snapshotLock:
+            self.autelisSnapshots = saved.get("documents", {})
+        if saved:
+            self.logger.debug(f"Loaded state snapshot from {time.time() - saved.get('saved', 0):.0f} seconds ago: "
+                              f"{len(self.replied)} replies, {len(self.autelisSnapshots)} Autelis documents")
+
+    def saveSnapshot(self):
+        # Save what a warm start needs: when and what the panel last reported, and the fetched Autelis documents.
+        with self.snapshotLock:
+            documents = dict(self.autelisSnapshots)
+        snapshot = {"source": self.source, "saved": time.time(), "replies": dict(self.replied), "documents": documents}
+        self.savePref("stateSnapshot", json.dumps(snapshot, separators=(",", ":")))
+
+    def isWarm(self, query, states, now):
+        # True if the panel answered this status query recently enough, and the device still shows that answer.
+        entry = self.replied.get(ProtocolEngine.codeFor(query))
+        if entry is None or now - entry[0] >= self.warmStartAge:
+            return False
+        shown, replied = states.get(entry[2]), entry[3]
+        if entry[2] == "onOffState":
+            # Indigo keeps it as a bool; a snapshot from before circuits were decoded to bools has "on"/"off"
+            shown, replied = shown in (True, "on"), replied in (True, "on")
+        return shown == replied
+
+    def run(self):
+        # This is what runs on the controller's own thread while the plugin is 'running'.
+        # Frames from the serial device are assembled by the reader thread and arrive here as events, to be parsed and
+        # handed off to whatever device/or variable needs to have its state updated. Queuing a command wakes this
+        # thread too, so it is written to the interface right away. Between events, the thread sleeps until the next
+        # timer (Autelis poll, reply timeout, startup sync) is due.
+        try:
+            while self.running:
+                try:
+                    event = self.events.get(timeout=self.nextWait())
+                except queue.Empty:
+                    event = None
+                passStart = time.perf_counter()
+                while event is not None:
+                    self.handleEvent(event)
+                    try:
+                        event = self.events.get_nowait()
+                    except queue.Empty:
+                        event = None
+
+                if self.reconnectAt is not None and time.time() >= self.reconnectAt:
+                    self.reconnect()
+                self.runStartupSync()
+                if self.portEnabled:
+                    self.checkCommandTimeouts()
+                    limit = min(self.protocol.room(), kCommandsPerTick)
+                    for command, queued in self.commQueue.get(limit, busy=self.protocol.busy()):
+                        if not self.portEnabled:
+                            # the connection dropped while writing this batch; keep the rest for after the reconnect
+                            self.commQueue.put(command, queued=queued)
+                            continue
+                        self.metrics.record("command.lag", time.time() - queued)
+                        self.sendCommand(command)
+                if self.pluginPrefs['interface'] == 'autelis':
+                    # HTTP polls only get queued here; the fetches run on the poll workers and the
+                    # decoded results are applied to devices as they come back.
+                    now = time.time()
+                    command = self.autelisCommands.next(now)
+                    if command is not None:
+                        self.submitPoll(self.autelisSend, *command)
+                    for xmlset in ("status", "chem"):
+                        if self.poller.due(kAutelisSections[xmlset], now):
+                            self.logger.debug("Refreshing %s.xml...", xmlset)
+                            self.poller.polled(kAutelisSections[xmlset], now)
+                            self.autelisRequestPoll(xmlset)
+                if self.optimistic:
+                    self.reconcileOptimistic(time.time())
+                if time.time() - self.metricsUpdated > kMetricsInterval:
+                    self.updateMetricStates()
+                self.flushStates()
+                self.metrics.record("loop", time.perf_counter() - passStart)
+                self.metrics.record("log.cycle", self.plugin.logTime())
+        except Exception as e:
+            self.logger.error(f"Error in controller thread: {e}")
+
+    def wake(self):
+        # Get the controller thread out of its wait (a command was queued, or it's time to stop).
+        self.events.put(("wake",))
+
+    def nextWait(self):
+        # Seconds until the controller thread next has timed work to do, at most kIdleWait.
+        now = time.time()
+        due = [now + kIdleWait]
+        if self.portEnabled:
+            # a command waiting for a reply to the same circuit code isn't ready; its reply (an event) or the reply
+            # deadline wakes the loop
+            if self.protocol.room() > 0 and self.commQueue.ready(self.protocol.busy()):
+                due.append(now)
+            deadline = self.protocol.nextDeadline()
+            if deadline is not None:
+                due.append(deadline)
+        elif self.reconnectAt is not None:
+            due.append(self.reconnectAt)
+        if self.pluginPrefs.get('interface') == 'autelis':
+            nextPoll = self.poller.nextDue()
+            if nextPoll is not None:
+                due.append(nextPoll)
+            nextCommand = self.autelisCommands.nextDue()
+            if nextCommand is not None:
+                due.append(nextCommand)
+        with self.syncLock:
+            if self.syncDevices:
+                due.append(self.syncLastAdded + kSyncSettle)
+        with self.stateLock:
+            if self.optimistic:
+                due.append(min(entry[3] for entry in self.optimistic.values()))
+        return min(max(min(due) - now, 0), kIdleWait)
+
+    def handleEvent(self, event):
+        kind = event[0]
+        if kind == "frame":
+            self.logger.debug("From Pentair: %s", event[1])
+            self.metrics.count("serial.frames")
+            with self.metrics.timer("parse.ilink"):
+                self.parse_ilink(event[1])
+        elif kind == "section":
+            with self.metrics.timer("decode." + event[1]):
+                self.autelisProcessSection(event[1], event[2])
+        elif kind == "done":
+            self.autelisFetchDone(event[1], event[2])
+        elif kind == "serialError":
+            if event[1] is self.conn:
+                self.connectionLost(event[2])
+        elif kind == "restart":
+            self.configure()
+
+    def serialReader(self, conn):
+        # Runs on its own thread for as long as conn is the plugin's connection, blocking in read() until bytes
+        # arrive. Frames are assembled from the byte stream and queued for the concurrent thread.
+        buffer = b""
+        while conn is self.conn:
+            try:
+                data = conn.read(conn.in_waiting or 1)
+            except Exception as err:
+                if conn is self.conn:
+                    self.events.put(("serialError", conn, err))
+                return
+            if not data:
+                continue
+            frames = re.split(rb"[\r\n]", buffer + data)
+            buffer = frames.pop()
+            for frame in frames:
+                if len(frame) > 2:
+                    self.events.put(("frame", frame.decode('ascii', errors='replace')))
+
+    def connectionLost(self, err):
+        # Called on the controller thread when the serial connection fails. Commands in flight go back on the queue,
+        # and a reconnect is scheduled; until then run() only buffers commands.
+        if self.outageStarted is None:
+            self.outageStarted = time.time()
+            self.metrics.count("serial.disconnects")
+            self.logger.error(f"Serial Connection Lost ({err}). Reconnecting...")
+        conn = self.conn
+        self.conn = None
+        self.portEnabled = False
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        for command, sentTime in self.protocol.abandon():
+            self.outageCircuits.add(ProtocolEngine.codeFor(command))
+            self.commQueue.put(command, queued=sentTime)
+        # without the socket, fall back to regular HTTP polling
+        self.configurePolling()
+        self.scheduleReconnect()
+        self.publishHealth()
+
+    def scheduleReconnect(self):
+        delay = min(kReconnectFirst * 2 ** self.reconnectAttempts, kReconnectLongest)
+        delay *= random.uniform(1 - kReconnectJitter, 1 + kReconnectJitter)
+        self.reconnectAttempts += 1
+        self.reconnectAt = time.time() + delay
+
+    def reconnect(self):
+        # Try to reopen the serial port. On success, drop commands that waited too long and re-query every device
+        # whose state may have changed while nobody was listening.
+        self.reconnectAt = None
+        if not self.openConnection():
+            if self.reconnectAttempts < kSerialRetry:
+                self.logger.warning(f"Reconnect to {self.serialUrl} failed, attempt {self.reconnectAttempts}")
+            else:
+                self.logger.debug(f"Reconnect to {self.serialUrl} failed, attempt {self.reconnectAttempts}")
+            self.scheduleReconnect()
+            return
+
+        now = time.time()
+        outage = now - (self.outageStarted or now)
+        self.metrics.record("serial.outage", outage)
+        self.logger.info(f"Serial Connection restored after {outage:.1f} seconds")
+        for command in self.commQueue.expire(kCommandTTL, now):
+            self.logger.warning(f"Dropped command '{command}', queued too long while the connection was down")
+            self.metrics.count("command.expired")
+            self.outageCircuits.add(ProtocolEngine.codeFor(command))
+        with self.stateLock:
+            if outage > kStaleOutage:
+                shadows = list(self.circuit_dev.values())
+            else:
+                shadows = [self.circuit_dev[code] for code in self.outageCircuits if code in self.circuit_dev]
+        queries = []
+        documents = []
+        for shadow in shadows:
+            deviceQueries, deviceDocuments = self.statusRequests(shadow.deviceTypeId, shadow.props["circuitselect"])
+            queries += deviceQueries
+            documents += deviceDocuments
+        if queries or documents:
+            self.logger.debug(f"Re-syncing {len(shadows)} devices after the outage")
+            self.addStartupSync(queries, documents)
+        self.reconnectAttempts = 0
+        self.outageStarted = None
+        self.outageCircuits = set()
+
+    def statusRequests(self, deviceTypeId, circuitcode):
+        # The status queries and Autelis documents needed to bring one device's states up to date.
+        queries = []
+        documents = []
+        if deviceTypeId == "circuit":
+            queries.append(circuitcode + " ?")
+        elif deviceTypeId == "heater":
             # If we're starting pool or spa heater devices, we'll need more status info... setpoint and temp.
             if self.pluginPrefs['interface'] == "autelis":
-                self.autelisProcessTemp()
+                documents.append("status")
             else:
-                self.commQueue.append(circuitcode + " ?")
-                self.commQueue.append(circuitcode[:-2] + "SP ?")
-                self.commQueue.append(circuitcode[:-2] + "TMP ?")
-        elif dev.deviceTypeId == "system":
+                queries.append(circuitcode + " ?")
+                queries.append(circuitcode[:-2] + "SP ?")
+                queries.append(circuitcode[:-2] + "TMP ?")
+        elif deviceTypeId == "system":
             if self.pluginPrefs['interface'] == "autelis":
-                self.autelisProcessStatus()
-                self.autelisProcessChem()
+                documents.append("status")
+                documents.append("chem")
+        return queries, documents
 
-    def deviceStopComm(self, dev):
-        del self.circuit_dev[dev.pluginProps["circuitselect"]]
-        self.logger.debug("Just deleted: " + dev.pluginProps["circuitselect"] + " from circuitdev")
+    def addStartupSync(self, queries, documents, skipped=0):
+        # Collect the status queries and Autelis documents a starting device needs, to be sent by runStartupSync.
+        # skipped counts the queries left out because the warm start snapshot still covers them.
+        with self.syncLock:
+            if self.syncStarted is None:
+                self.syncStarted = time.time()
+            self.syncQueries.update(queries)
+            self.syncDocuments.update(documents)
+            self.syncDevices += 1
+            self.syncSkipped += skipped
+            self.syncLastAdded = time.time()
+        # let the controller thread take the settle deadline into account
+        self.wake()
 
-    def validatePrefsConfigUi(self, valuesDict):
+    @staticmethod
+    def syncOrder(query):
+        # Sort key for startup queries: system and heater values first, then POOL/SPA, then AUX1-AUX50 in order.
+        code = ProtocolEngine.codeFor(query)
+        aux = re.match(r"AUX(\d+)$", code)
+        if aux:
+            return 2, int(aux.group(1)), code
+        if code in ("POOL", "SPA"):
+            return 1, 0, code
+        return 0, 0, code
 
-        errorsDict = indigo.Dict()
-        self.logger.debug("Validating Serial Port")
-        self.validateSerialPortUi(valuesDict, errorsDict, "serialport")
+    def runStartupSync(self):
+        # Once devices have stopped starting up, send everything they asked for as a single batch.
+        with self.syncLock:
+            if self.syncDevices == 0 or time.time() - self.syncLastAdded < kSyncSettle:
+                return
+            queries = sorted(self.syncQueries, key=self.syncOrder)
+            documents = sorted(self.syncDocuments)
+            devices = self.syncDevices
+            skipped = self.syncSkipped
+            self.syncQueries = set()
+            self.syncDocuments = set()
+            self.syncDevices = 0
+            self.syncSkipped = 0
+            self.syncWaiting.update(ProtocolEngine.codeFor(query) for query in queries)
+            self.syncWaiting.update(xmlset + ".xml" for xmlset in documents)
+            current = not self.syncWaiting and self.syncStarted is not None
+            if current:
+                # every device is covered by the warm start snapshot
+                self.syncDuration = time.time() - self.syncStarted
+                self.syncStarted = None
+        self.logger.debug(f"Startup sync for {devices} devices: {len(queries)} queries, {len(documents)} Autelis documents, "
+                          f"{skipped} queries answered by the warm start snapshot")
+        if current:
+            self.logger.info(f"Device state sync complete in {self.syncDuration:.2f} seconds")
+        for query in queries:
+            self.commQueue.put(query)
+        for xmlset in documents:
+            self.autelisRequestPoll(xmlset, force=True)
 
-        if len(errorsDict) > 0:
-            return False, valuesDict, errorsDict
-        return True, valuesDict
+    def startupSyncDone(self, key):
+        # Note that the reply to one startup query (circuit code) or document ("status.xml") has arrived.
+        with self.syncLock:
+            if key not in self.syncWaiting:
+                return
+            self.syncWaiting.discard(key)
+            if self.syncWaiting or self.syncQueries or self.syncDocuments or self.syncStarted is None:
+                return
+            self.syncDuration = time.time() - self.syncStarted
+            self.syncStarted = None
+        self.logger.info(f"Device state sync complete in {self.syncDuration:.2f} seconds")
 
-    def closedPrefsConfigUi(self, valuesDict, userCancelled):
-        self.logger.debug("closedPrefsConfigUI() called")
-        if not userCancelled:
-            if valuesDict['showDebugInfo']:
-                self.debug = True
-            else:
-                self.debug = False
+    def recordHistory(self, circuitcode, key, value):
+        # Add a decoded reading to its history series, if it has one; the series' interval decides whether it's kept.
+        # Called with stateLock held.
+        series = self.historyKeys.get((circuitcode, key))
+        if series is not None and isinstance(value, (int, float)):
+            self.history[series].add(time.time(), value)
 
-            if valuesDict['logTemps']:
-                self.logTemps = True
+    def queueState(self, circuitcode, key, value):
+        # Queue a decoded state value for the next flushStates. Returns False if the server already has that value.
+        with self.stateLock:
+            shadow = self.circuit_dev.get(circuitcode)
+            if shadow is None:
+                return False
+            self.recordHistory(circuitcode, key, value)
+            entry = self.optimistic.get((circuitcode, key))
+            if entry is not None:
+                if value != entry[0]:
+                    # not (yet) what the action asked for: keep showing the expected value until the deadline
+                    entry[2] = value
+                    return False
+                del self.optimistic[(circuitcode, key)]
+                self.metrics.count("optimistic.confirmed")
+                if not any(code == circuitcode for code, state in self.optimistic):
+                    self.pendingStates.setdefault(circuitcode, {})["pending"] = False
+            pending = self.pendingStates.get(circuitcode, {})
+            if key in pending:
+                if pending[key] == value:
+                    return False
+            elif key in shadow.states and shadow.states[key] == value:
+                return False
+            self.pendingStates.setdefault(circuitcode, {})[key] = value
+        return True
+
+    def flushStates(self):
+        # Write all queued state changes, one updateStatesOnServer call per device.
+        with self.stateLock:
+            pending = self.pendingStates
+            self.pendingStates = {}
+            writes = []
+            for circuitcode, states in pending.items():
+                shadow = self.circuit_dev.get(circuitcode)
+                if shadow is not None:
+                    shadow.states.update(states)
+                    writes.append((shadow.dev, states))
+        for dev, states in writes:
+            with self.metrics.timer("state.write"):
+                dev.updateStatesOnServer([{'key': key, 'value': value} for key, value in states.items()])
+                if "hvacOperationMode" in states:
+                    if states["hvacOperationMode"] == 0:
+                        dev.updateStateImageOnServer(indigo.kStateImageSel.HvacOff)
+                    else:
+                        dev.updateStateImageOnServer(indigo.kStateImageSel.HvacHeating)
+            self.metrics.count("state.keysWritten", len(states))
+
+    def setOptimistic(self, circuitcode, key, value):
+        # In optimistic mode, show the result of an action right away and mark the device pending until confirmed.
+        if not self.optimisticMode:
+            return
+        with self.stateLock:
+            shadow = self.circuit_dev.get(circuitcode)
+            if shadow is None:
+                return
+            states = self.pendingStates.setdefault(circuitcode, {})
+            entry = self.optimistic.get((circuitcode, key))
+            previous = entry[1] if entry is not None else states.get(key, shadow.states.get(key))
+            self.optimistic[(circuitcode, key)] = [value, previous, None, time.time() + self.confirmTimeout]
+            states[key] = value
+            states["pending"] = True
+
+    def reconcileOptimistic(self, now, rejected=None):
+        # Roll back optimistic values the panel hasn't confirmed in time, and the one a rejected command set (rejected,
+        # a (circuit code, state) key), to the value it last reported (or the value from before the action if it
+        # reported nothing).
+        rolledBack = []
+        with self.stateLock:
+            for (circuitcode, key), (expected, previous, reported, deadline) in list(self.optimistic.items()):
+                if deadline > now and (circuitcode, key) != rejected:
+                    continue
+                del self.optimistic[(circuitcode, key)]
+                value = previous if reported is None else reported
+                states = self.pendingStates.setdefault(circuitcode, {})
+                if value is not None:
+                    states[key] = value
+                if not any(code == circuitcode for code, state in self.optimistic):
+                    states["pending"] = False
+                shadow = self.circuit_dev.get(circuitcode)
+                rolledBack.append((shadow.name if shadow is not None else circuitcode, key, expected, value,
+                                   (circuitcode, key) == rejected))
+        for name, key, expected, value, refused in rolledBack:
+            if refused:
+                self.logger.warning(f"{name}: {key} {expected} rejected by the panel, back to {value}")
             else:
-                self.logTemps = False
+                self.logger.warning(f"{name}: {key} {expected} not confirmed within {self.confirmTimeout:.0f} seconds, "
+                                    f"back to {value}")
+            self.metrics.count("optimistic.rolledBack")
 
-            self.startup()
+    def rejectOptimistic(self, command):
+        # The panel answered a command with an error: roll back the value it was expected to set at once, instead of
+        # at its confirmation deadline. The command's reply code gives the state, as for a status reply.
+        code = ProtocolEngine.codeFor(command)
+        entry = self.ilinkDecoders.get(code)
+        target = (code, "onOffState") if entry is None else (entry[1], entry[2])
+        with self.stateLock:
+            if target not in self.optimistic:
+                return
+        self.reconcileOptimistic(time.time(), rejected=target)
 
-    def runConcurrentThread(self):
-        # This is what runs as the plugin is simply 'running'.
-        # Basically, if a command comes in from the serial device, you read it, parse it and hand it off to
-        # whatever device/or variable needs to have its state updated.
-        # In the meantime, you have a queue set up which gets loaded with commands from devices which must be fed
-        # to the serial interface to be enacted.
-        sleeptime = 0.1
+    def sendCommand(self, command):
+        # Write one command to the interface and start waiting for its reply.
+        self.protocol.sent(command, time.time())
+        self.metrics.count("command.sent")
+        if self.pluginPrefs['interface'] == 'autelis' and not command.endswith("?") and not self.pushActive():
+            # (with push updates, the result is reported on the socket, see autelisStreamChange)
+            self.poller.expedite(time.time())
+        if self.pluginPrefs['interface'] == 'autelis':
+            command = command.replace(" ", "")
+        else:
+            command = command.replace("POOL ", "PUMP ")
+        self.logger.debug("To Pentair: %s", command)
         try:
-            while True:
-                if self.portEnabled:
-                    from_pentair = self.conn.readline().decode('ascii')
-                    if len(from_pentair) > 3:
-                        self.logger.debug(f"From Pentair: {from_pentair[:-1]}")  # removes last character (CR)
-                        self.parse_ilink(from_pentair[:-1])
-                    if len(self.commQueue) > 0:
-                        command = self.commQueue.pop(0)
-                        if self.pluginPrefs['interface'] == 'autelis':
-                            command = command.replace(" ", "")
-                        else:
-                            command = command.replace("POOL ", "PUMP ")
-                        self.logger.debug("To Pentair: " + command)
-                        sendcount = self.conn.write("#" + command + "\r")
-                if self.pluginPrefs['interface'] == 'autelis':
-                    if time.time() > self.next_refresh:
-                        self.logger.debug("Refreshing Panel Status...")
-                        self.autelisProcessStatus()
-                    if time.time() > self.refreshChem:
-                        self.logger.debug("Refreshing Chem...")
-                        self.autelisProcessChem()
-                        self.autelisProcessTemp()
-
-                self.sleep(sleeptime)
-        except self.StopThread:
-            pass
-        except serial.SerialException:
-            self.conn.close()
-            self.sleep(10)
-            self.logger.error("Serial Connection Lost. Trying again in 10 seconds...")
-            self.startup()
-        except Exception as e:
-            self.logger.error(f"Error in runConcurrentThread: {e}")
+            sendcount = self.conn.write(("#" + command + "\r").encode('ascii'))
+        except (serial.SerialException, OSError) as err:
+            self.connectionLost(err)
+
+    def checkCommandTimeouts(self):
+        # Resend commands whose reply is overdue, and give up on the ones that are out of attempts.
+        resend, dropped = self.protocol.expired(time.time())
+        for command in dropped:
+            self.logger.error(f"No response from Pentair to command '{command}'")
+            self.metrics.count("command.failed")
+            self.startupSyncDone(ProtocolEngine.codeFor(command))
+        for command in resend:
+            self.logger.debug(f"No response to '{command}', resending")
+            self.metrics.count("command.retried")
+            self.sendCommand(command)
+
+    def buildIlinkDecoders(self):
+        # Precompute how every status reply is decoded, so parse_ilink is a regex match and a dictionary lookup.
+        # Indigo keeps a relay's onOffState as a bool, so that's what is decoded (and compared with the shadow)
+        onOff = {"0": False, "1": True}.__getitem__
+        if self.pluginPrefs.get('interface') == 'autelis':
+            heaterMode = {"HEATER": 1, "OFF": 0}.__getitem__
+        else:
+            heaterMode = int
+        valueDecoders = {"hmode": heaterMode, "temp": int, "ilinkOpmode": self.ilinkOpmode, "onOff": onOff}
+
+        decoders = {}
+        for code, (circuitcode, statecode, suffix, dataproc) in self.pentairStateMap.items():
+            decoders[code] = (code, circuitcode, statecode, suffix, dataproc, valueDecoders[dataproc])
+        for code in ["AUX" + str(cir) for cir in range(1, 51)] + ["POOL", "SPA"]:
+            decoders[code] = (code, code, "onOffState", "", "onOff", onOff)
+        # the iLink reports the pool circuit as PUMP
+        decoders["PUMP"] = decoders["POOL"]
+        self.ilinkDecoders = decoders
 
     def parse_ilink(self, from_pi):
-        # Looks Messy, but it's really just a bunch of tests to see what kind of statement it is
-        # and then handling it - start with simple statements, so we can just move on from there.
-        # Start by checking for errors...
-        if from_pi[0] == "?":
-            self.errorLog("Pentair Error: " + from_pi[1:])
-        elif from_pi[:3] == "!00":
-            # Now that we know this is giving status of a circuit, we can decide
-            # which circuit and update the state on server. If not defined, just bail out and discard the response.
-            # Now, just move on to parsing out which circuit does what.
-            #
-            #
-            # Responses from Pentair iLink and Autellis adapter vary slightly on spacing, so reformat the response to match
-            if self.pluginPrefs['interface'] == 'autelis':
-                from_pi = from_pi.replace("=", " = ")
-            from_pi = from_pi.replace("PUMP", "POOL")
-            resplist = from_pi.split()
-            responseCode = resplist[1]
-            # Different reported circuits all map to different devices, variable names and have different data formats
-            # Basically, look up processing instructions from a dictionary, and process.
-            if responseCode in self.pentairStateMap:
-                circuitcode = self.pentairStateMap[responseCode][0]
-                statecode = self.pentairStateMap[responseCode][1]
-                suffix = self.pentairStateMap[responseCode][2]
-                dataproc = self.pentairStateMap[responseCode][3]
+        # Decode one frame from the iLink / Autelis socket: an error, or the status of one circuit.
+        status = kStatusFrame.match(from_pi)
+        if status is None:
+            error = kErrorFrame.match(from_pi)
+            if error is None:
+                self.logger.debug("Ignoring unrecognized frame: %s", from_pi)
+                return
+            command = self.protocol.failed()
+            self.metrics.count("command.errors")
+            if command is None:
+                self.logger.error("Pentair Error: " + error.group(1))
             else:
-                circuitcode = responseCode
-                statecode = "onOffState"
-                suffix = ""
-                dataproc = "onOff"
+                self.logger.error("Pentair Error: " + error.group(1) + " (command '" + command + "')")
+                # a rejected startup query won't be answered, so don't keep the sync waiting for it
+                self.startupSyncDone(ProtocolEngine.codeFor(command))
+                self.rejectOptimistic(command)
+            return
 
-            if dataproc == "hmode":
-                if self.pluginPrefs['interface'] == 'autelis':
-                    modes = {"HEATER": 1, "OFF": 0}
-                    repvalue = modes[resplist[3]]
-                else:
-                    repvalue = int(resplist[3])
-            elif dataproc == "temp":
-                repvalue = int(resplist[3])
-            elif dataproc == "ilinkOpmode":
-                repvalue = self.ilinkOpmode(resplist[3])
-            else:
-                modes = ("off", "on")
-                repvalue = modes[int(resplist[3])]
-
-            # With all data now correctly formatted, just check if the circuit's in use, update and log the changes.
-            if circuitcode in self.circuit_dev:
-                servdev = indigo.devices[self.circuit_dev[circuitcode]]
-                servdev.updateStateOnServer(statecode, value=repvalue)
-                if dataproc == "hmode":
-                    if repvalue == 0:
-                        servdev.updateStateImageOnServer(indigo.kStateImageSel.HvacOff)
-                    else:
-                        servdev.updateStateImageOnServer(indigo.kStateImageSel.HvacHeating)
+        reportedCode, value = status.groups()
+        entry = self.ilinkDecoders.get(reportedCode)
+        if entry is None:
+            # circuits we have no table entry for report a plain on/off value
+            entry = (reportedCode, reportedCode, "onOffState", "", "onOff", self.ilinkDecoders["POOL"][5])
+        responseCode, circuitcode, statecode, suffix, dataproc, decoder = entry
 
-                if 'temp' in statecode:
-                    if self.logTemps:
-                        self.logger.info(servdev.name + suffix + " is " + str(repvalue))
-                else:
-                    self.logger.info(servdev.name + suffix + " is " + str(repvalue))
+        now = time.time()
+        completed = self.protocol.matched(responseCode, now)
+        if completed is not None:
+            self.logger.debug("Command '%s' confirmed after %.0f ms", completed[0], completed[1] * 1000)
+            self.metrics.record("command.roundTrip", completed[1])
+            self.startupSyncDone(responseCode)
+
+        try:
+            repvalue = decoder(value)
+        except (KeyError, ValueError):
+            self.logger.warning(f"Unexpected value '{value}' for {responseCode} in frame: {from_pi}")
+            return
+        self.replied[responseCode] = (now, circuitcode, statecode, repvalue)
+
+        # With all data now correctly formatted, just check if the circuit's in use, update and log the changes.
+        if circuitcode in self.circuit_dev:
+            servdev = self.circuit_dev[circuitcode]
+            shown = repvalue if dataproc != "onOff" else ("on" if repvalue else "off")
+            if not self.queueState(circuitcode, statecode, repvalue):
+                self.logger.debug("%s%s is %s", servdev.name, suffix, shown)
+                return
+            if self.pushActive():
+                self.autelisStreamChange(responseCode)
 
+            if 'temp' in statecode:
+                if self.plugin.logTemps:
+                    self.logger.info("%s%s is %s", servdev.name, suffix, shown)
             else:
-                self.logger.debug("Circuit " + circuitcode + " currently not in use by Indigo.")
+                self.logger.info("%s%s is %s", servdev.name, suffix, shown)
+
+        else:
+            self.logger.debug("Circuit %s currently not in use by Indigo.", circuitcode)
 
     def actionControlDimmerRelay(self, action, dev):
         circuitcode = dev.pluginProps["circuitselect"]
-        comOn = " = 1"
-        comOff = " = 0"
-        if self.pluginPrefs['interface'] == 'autelis':
-            comOn = "=T"
-            comOff = "=F"
         self.logger.debug("actionControlDimmerRelay called")
         self.logger.debug("circuitcode is: " + circuitcode)
         if action.deviceAction == indigo.kDeviceAction.TurnOn:
-            self.logger.info("Turn On " + dev.name)
-            self.logger.debug("Turn On " + circuitcode)
-            self.commQueue.append(circuitcode + comOn)
+            self.setCircuitStates({circuitcode: True}, skipUnchanged=False)
         elif action.deviceAction == indigo.kDeviceAction.TurnOff:
-            self.logger.info("Turn Off " + dev.name)
-            self.logger.debug("Turn Off " + circuitcode)
-            self.commQueue.append(circuitcode + comOff)
+            self.setCircuitStates({circuitcode: False}, skipUnchanged=False)
         elif action.deviceAction == indigo.kDeviceAction.Toggle:
             self.logger.info("Toggle " + dev.name)
-            self.logger.debug("Toggle " + circuitcode)
             self.logger.debug("Device onState: " + str(dev.onState))
-            if dev.onState == 0:
-                self.commQueue.append(circuitcode + comOn)
+            self.setCircuitStates({circuitcode: dev.onState == 0}, skipUnchanged=False)
+
+    def setCircuits(self, pluginAction):
+        # Action: switch several circuits as one batch. The "circuits" prop lists circuit=state pairs, by circuit code
+        # or by the name from names.xml, as text ("AUX1=on, WATERFALL=off, SPA=toggle") or as a list of such strings.
+        changes = self.parseCircuitList(pluginAction.props.get("circuits", ""))
+        if changes:
+            self.setCircuitStates(changes)
+
+    def parseCircuitList(self, spec):
+        # Turn circuit=state pairs into {circuit code: True/False}, in order. A circuit listed twice takes its last state.
+        if isinstance(spec, str):
+            spec = re.split(r"[,;\n]", spec)
+        byName = {name.upper(): code for code, name in self.system_names.items()}
+        changes = {}
+        for entry in spec:
+            entry = entry.strip()
+            if not entry:
+                continue
+            match = re.match(r"^(.+?)\s*[=:]\s*(on|off|toggle|1|0|true|false)$", entry, re.IGNORECASE)
+            if match is None:
+                self.logger.error(f"Ignoring '{entry}': expected circuit=on, off or toggle")
+                continue
+            name, state = match.group(1).strip().upper(), match.group(2).lower()
+            code = byName.get(name, name.replace(" ", ""))
+            entry = self.ilinkDecoders.get(code)
+            if entry is None or entry[4] != "onOff":
+                self.logger.error(f"Ignoring '{match.group(1)}': not a circuit")
+                continue
+            code = entry[1]     # PUMP -> POOL
+            if state == "toggle":
+                shadow = self.circuit_dev.get(code)
+                on = shadow is not None and shadow.states.get("onOffState") in (True, "on")
+                changes.pop(code, None)
+                changes[code] = not on
             else:
-                self.commQueue.append(circuitcode + comOff)
-        if circuitcode == "POOL":
-            self.commQueue.append("SPA ?")
-        elif circuitcode == "SPA":
-            self.commQueue.append("POOL ?")
+                changes.pop(code, None)
+                changes[code] = state in ("on", "1", "true")
+        return changes
+
+    def setCircuitStates(self, changes, skipUnchanged=True):
+        # Queue one batch of circuit changes ({circuit code: True/False}). Pool and spa share equipment, so only one
+        # of them can be on: a batch turning both on keeps the one listed last, and switching one on makes turning the
+        # other off redundant. Circuits already in the requested state are skipped unless skipUnchanged is False.
+        # However many circuits change, the other body is queried once at the end to pick up the panel's switch-over.
+        if changes.get("POOL") and changes.get("SPA"):
+            keep = [code for code in changes if code in ("POOL", "SPA")][-1]
+            drop = "SPA" if keep == "POOL" else "POOL"
+            self.logger.warning(f"POOL and SPA can't both be on, turning on {keep} only")
+            del changes[drop]
+        for body, other in (("POOL", "SPA"), ("SPA", "POOL")):
+            if changes.get(body) and changes.get(other) is False:
+                del changes[other]
+
+        comOn = " = 1"
+        comOff = " = 0"
+        if self.pluginPrefs['interface'] == 'autelis':
+            comOn = "=T"
+            comOff = "=F"
+        queued = 0
+        for circuitcode, on in changes.items():
+            shadow = self.circuit_dev.get(circuitcode)
+            name = shadow.name if shadow is not None else circuitcode
+            if skipUnchanged and shadow is not None and (shadow.states.get("onOffState") in (True, "on")) == on:
+                self.logger.debug(f"{name} is already {'on' if on else 'off'}")
+                continue
+            self.logger.info(("Turn On " if on else "Turn Off ") + name)
+            self.commQueue.put(circuitcode + (comOn if on else comOff))
+            self.setOptimistic(circuitcode, "onOffState", on)
+            queued += 1
+        bodies = {"POOL", "SPA"} & set(changes)
+        if len(bodies) == 1:
+            self.commQueue.put(("SPA" if "POOL" in bodies else "POOL") + " ?")
+        if len(changes) > 1:
+            self.logger.debug(f"Circuit batch: {queued} commands queued, {len(changes) - queued} circuits unchanged")
+            self.metrics.count("command.batches")
 
     def actionControlThermostat(self, action, dev):
         circuitcode = dev.pluginProps["circuitselect"]
@@ -351,64 +1741,74 @@ class Plugin(indigo.PluginBase):
                     sendMode = "OFF"
             else:
                 sendMode = str(action.actionMode)
-            self.commQueue.append(circuitcode + " = " + sendMode)
-            pass
+            self.commQueue.put(circuitcode + " = " + sendMode)
+            self.setOptimistic(circuitcode, "hvacOperationMode", 0 if sendMode in ("OFF", "0") else int(action.actionMode))
         elif action.thermostatAction == indigo.kThermostatAction.SetHeatSetpoint:
             newSetpoint = action.actionValue
-            self.commQueue.append(circuitcode[:-2] + "SP = " + str(int(action.actionValue)))
+            self.commQueue.put(circuitcode[:-2] + "SP = " + str(int(action.actionValue)))
+            self.setOptimistic(circuitcode, "setpointHeat", int(newSetpoint))
         elif action.thermostatAction == indigo.kThermostatAction.IncreaseHeatSetpoint:
             newSetpoint = dev.heatSetpoint + action.actionValue
-            self.commQueue.append(circuitcode[:-2] + "SP = " + str(int(newSetpoint)))
+            self.commQueue.put(circuitcode[:-2] + "SP = " + str(int(newSetpoint)))
+            self.setOptimistic(circuitcode, "setpointHeat", int(newSetpoint))
         elif action.thermostatAction == indigo.kThermostatAction.DecreaseHeatSetpoint:
             newSetpoint = dev.heatSetpoint - action.actionValue
-            self.commQueue.append(circuitcode[:-2] + "SP = " + str(int(newSetpoint)))
+            self.commQueue.put(circuitcode[:-2] + "SP = " + str(int(newSetpoint)))
+            self.setOptimistic(circuitcode, "setpointHeat", int(newSetpoint))
         elif action.thermostatAction in [indigo.kThermostatAction.RequestStatusAll, indigo.kThermostatAction.RequestMode,
                                          indigo.kThermostatAction.RequestEquipmentState, indigo.kThermostatAction.RequestTemperatures,
                                          indigo.kThermostatAction.RequestSetpoints]:
             if self.pluginPrefs["interface"] == 'autelis':
-                self.autelisProcessTemp()
+                self.autelisRequestPoll("status", force=True)
             else:
-                self.commQueue.append(circuitcode + " ?")
-                self.commQueue.append(circuitcode[:-2] + "SP ?")
-                self.commQueue.append(circuitcode[:-2] + "TMP ?")
+                self.commQueue.put(circuitcode + " ?")
+                self.commQueue.put(circuitcode[:-2] + "SP ?")
+                self.commQueue.put(circuitcode[:-2] + "TMP ?")
             pass
 
     def intellibriteOn(self, pluginAction):
         if self.pluginPrefs['interface'] == 'autelis':
-            self.autelisCommand("lights", "none", "val", "allon")
+            self.autelisCommand("lights", "none", "val", "allon", "Intellibrite all on")
         else:
-            self.commQueue.append("ALLLIGHTS = 1")
+            self.commQueue.put("ALLLIGHTS = 1")
 
     def intellibriteOff(self, pluginAction):
         if self.pluginPrefs['interface'] == 'autelis':
-            self.autelisCommand("lights", "none", "val", "alloff")
+            self.autelisCommand("lights", "none", "val", "alloff", "Intellibrite all off")
         else:
-            self.commQueue.append("ALLLIGHTS = 0")
+            self.commQueue.put("ALLLIGHTS = 0")
 
     def setSetPoint(self, pluginAction, dev):
-        self.logger.info("Change Set Point of " + dev.name + " to " + str(pluginAction.props.get(u"reqtemp")))
+        try:
+            reqtemp = int(pluginAction.props.get(u"reqtemp"))
+        except (TypeError, ValueError):
+            self.logger.error(f"Set Point for {dev.name} must be a whole number, not '{pluginAction.props.get(u'reqtemp')}'")
+            return
+        self.logger.info("Change Set Point of " + dev.name + " to " + str(reqtemp))
         circuitbase = dev.pluginProps["circuitselect"]
         operator = ""
         if circuitbase == "POOL":
             operator = "POOLSP"
         elif circuitbase == "SPA":
             operator = "SPASP"
-        self.commQueue.append(operator + " = " + str(pluginAction.props.get(u"reqtemp")))
+        self.commQueue.put(operator + " = " + str(reqtemp))
+        if operator:
+            self.setOptimistic(operator[:-2] + "HT", "setpointHeat", reqtemp)
 
     def setIntellibriteMode(self, pluginAction):
         setmode = pluginAction.props.get(u"newmode")
         self.logger.info("Setting Intellibrite Mode to " + setmode)
         if self.pluginPrefs['interface'] == 'autelis':
             setmode = setmode[3:].lower()
-            self.autelisCommand("lights", "none", "val", setmode)
+            self.autelisCommand("lights", "none", "val", setmode, "Intellibrite mode " + setmode)
         else:
-            self.commQueue.append(setmode)
+            self.commQueue.put(setmode)
 
     def superChlor(self, pluginAction):
         hours = min(int(pluginAction.props.get("hours")), 24)
         if self.pluginPrefs['interface'] == 'autelis':
             self.logger.info("Super-Chlorinating for " + str(hours) + " hours")
-            self.autelisCommand("chlor", "SYSTEM", "super", str(hours))
+            self.autelisCommand("chlor", "SYSTEM", "super", str(hours), "Super-chlorinate", collapse=True)
         else:
             self.logger.error("Interface must be 'Autelis' to execute Super-Chlor Action")
 
@@ -417,20 +1817,118 @@ class Plugin(indigo.PluginBase):
         level = max(min(int(pluginAction.props.get("chlorLevel")), 100), 0)
         if self.pluginPrefs['interface'] == 'autelis':
             self.logger.info("Setting " + param + " chlorination level to " + str(level) + "%")
-            self.autelisCommand("chlor", "SYSTEM", param, str(level))
+            self.autelisCommand("chlor", "SYSTEM", param, str(level), param + " chlorination level", collapse=True)
         else:
             self.logger.error("Interface must be 'Autelis' to set chlorination level")
 
-    def genAuxCircuitList(self, filter, valuesDict, typeID, targetID):
-        # method to generate lists with names/labels.
-        auxList = []
-        for cir in range(1, 51):
-            pname = "AUX" + str(cir)
-            auxList.append((pname, pname))
-        auxList.append(("POOL", "POOL"))
-        auxList.append(("SPA", "SPA"))
-        self.logger.debug(f"genAuxCircuitList: {auxList}")
-        return auxList
+    def updateMetricStates(self):
+        # Publish the key figures as states on the system device, so triggers can watch for growing command lag.
+        self.metricsUpdated = time.time()
+        self.publishHealth()
+        self.publishHistory()
+        if "SYSTEM" not in self.circuit_dev:
+            return
+        for state, name in (("command_lag_p95", "command.lag"), ("command_rtt_p95", "command.roundTrip"),
+                            ("http_fetch_p95", "http.fetch.status"), ("loop_time_p95", "loop")):
+            figures = self.metrics.percentiles(name)
+            if figures is not None:
+                self.queueState("SYSTEM", state, int(round(figures[1] * 1000)))
+        self.queueState("SYSTEM", "queue_depth", len(self.commQueue))
+        self.queueState("SYSTEM", "commands_failed", self.metrics.counters["command.failed"])
+        if self.syncDuration is not None:
+            self.queueState("SYSTEM", "sync_time", int(round(self.syncDuration * 1000)))
+
+    def publishHealth(self):
+        # Health and throughput of this panel, as states of its controller device (the default controller has none;
+        # its figures are on the system device).
+        if self.dev is None:
+            return
+        if self.portEnabled:
+            connection = "connected"
+        elif self.reconnectAt is not None:
+            connection = "reconnecting"
+        elif self.serialUrl == "":
+            connection = "http only"
+        else:
+            connection = "not connected"
+        rtt = self.metrics.percentiles("command.roundTrip")
+        self.dev.updateStatesOnServer([
+            {'key': 'connection', 'value': connection},
+            {'key': 'queue_depth', 'value': len(self.commQueue)},
+            {'key': 'commands_sent', 'value': self.metrics.counters["command.sent"]},
+            {'key': 'commands_failed', 'value': self.metrics.counters["command.failed"]},
+            {'key': 'command_rtt_p95', 'value': int(round(rtt[1] * 1000)) if rtt is not None else 0},
+            {'key': 'frames_received', 'value': self.metrics.counters["serial.frames"]},
+            {'key': 'reconnects', 'value': self.metrics.counters["serial.disconnects"]}
+        ])
+
+    def publishHistory(self):
+        # Derived states from the telemetry history: how fast each heater's water temperature is moving and when it
+        # should reach its set point, and the rolling salt level, salt trend and air temperature range.
+        now = time.time()
+        with self.stateLock:
+            figures = {series: history.stats(now) for series, history in self.history.items()}
+        for circuitcode, series in (("POOLHT", "poolTemp"), ("SPAHT", "spaTemp")):
+            shadow = self.circuit_dev.get(circuitcode)
+            if shadow is None:
+                continue
+            stats = figures[series]
+            rate = stats[4] * 3600 if stats is not None and stats[4] is not None else 0.0
+            self.queueState(circuitcode, "temp_rate", round(rate, 1))
+            self.queueState(circuitcode, "heat_eta", self.heatEta(shadow.states, rate))
+        if "SYSTEM" not in self.circuit_dev:
+            return
+        salt = figures["salt"]
+        if salt is not None:
+            self.queueState("SYSTEM", "salt_avg", int(round(salt[3])))
+            if salt[4] is not None:
+                self.queueState("SYSTEM", "salt_trend", int(round(salt[4] * 86400)))
+        air = figures["airTemp"]
+        if air is not None:
+            self.queueState("SYSTEM", "airtemp_low", int(air[1]))
+            self.queueState("SYSTEM", "airtemp_high", int(air[2]))
+
+    @staticmethod
+    def heatEta(states, rate):
+        # Minutes until a heater reaches its set point at the current rate of rise: 0 once there, -1 if it is off or
+        # the water isn't warming measurably.
+        try:
+            current = float(states.get("temperatureInput1"))
+            target = float(states.get("setpointHeat"))
+        except (TypeError, ValueError):
+            return -1
+        if current >= target:
+            return 0
+        if not states.get("hvacOperationMode") or rate < kHeatRateMin:
+            return -1
+        return int(round((target - current) / rate * 60))
+
+    def logMetrics(self):
+        # Menu item: dump counters and latency percentiles to the event log.
+        self.logger.info(f"Performance metrics (latencies over the last {kMetricSamples} samples):")
+        self.logger.info(f"queue depth: {len(self.commQueue)}, commands in flight: {len(self.protocol.outstanding)}")
+        if self.syncDuration is not None:
+            self.logger.info(f"startup sync: {self.syncDuration:.2f} s")
+        for line in self.metrics.summary():
+            self.logger.info(line)
+        now = time.time()
+        with self.stateLock:
+            figures = [(series, history.window, history.stats(now)) for series, history in sorted(self.history.items())]
+        for series, window, stats in figures:
+            if stats is not None:
+                count, low, high, mean, slope = stats
+                trend = f", trend {slope * 3600:+.2f}/h" if slope is not None else ""
+                self.logger.info(f"history {series} (last {window / 3600:g} h): {count} samples, min {low:g}, "
+                                 f"max {high:g}, mean {mean:.1f}{trend}")
+
+    def logPollStats(self):
+        # Menu item: how the adaptive Autelis polling compares with polling at the configured intervals.
+        if self.pluginPrefs.get('interface') != 'autelis':
+            self.logger.info("Polling statistics are only kept for the Autelis interface")
+            return
+        for name, (polls, fixed, interval) in sorted(self.poller.stats(time.time()).items()):
+            self.logger.info(f"{name}: {polls} polls, {max(fixed - polls, 0)} saved vs fixed schedule, "
+                             f"now every {interval:.0f} seconds")
 
     @staticmethod
     def autelisRunstate(rvalue):
@@ -444,133 +1942,371 @@ class Plugin(indigo.PluginBase):
 
         return rstate
 
-    def autelisCommand(self, comGroup, circuit, param, value):
-        url = "http://" + self.autelisIP + "/" + comGroup + ".cgi"
+    def makeAutelisSession(self):
+        # One keep-alive session (and connection pool) for all traffic to the Autelis web server.
+        # Failed connections and 5xx responses are retried a bounded number of times with exponential backoff.
+        session = requests.Session()
+        session.auth = ('admin', self.pluginPrefs.get('autpwd', ''))
+        retries = Retry(total=kAutelisRetries, backoff_factor=kAutelisBackoff, status_forcelist=(500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retries)
+        session.mount("http://", adapter)
+        return session
+
+    def autelisGet(self, path, **kwargs):
+        # GET a page from the Autelis interface using the shared session. Returns None if the request fails, or if
+        # the controller hasn't been started (no session yet).
+        if self.autelisSession is None:
+            self.logger.debug(f"Autelis request for {path} skipped, controller not started")
+            return None
+        url = "http://" + self.autelisIP + "/" + path
+        self.metrics.count("http.requests")
+        try:
+            return self.autelisSession.get(url, timeout=kAutelisTimeout, **kwargs)
+        except requests.exceptions.RequestException as err:
+            self.logger.error(f"Autelis request for {path} failed: {err}")
+            self.metrics.count("http.failures")
+            return None
+
+    def autelisCommand(self, comGroup, circuit, param, value, action, collapse=False):
+        # Queue a command for the Autelis web interface; it's sent by autelisSend, off the caller's thread, and its
+        # outcome is logged as the result of 'action'. collapse=True for a setting, where only the latest value
+        # matters (see AutelisDispatcher). Returns a Future for (success, seconds from queuing to response).
+        future, replaced = self.autelisCommands.put(comGroup, circuit, param, value, collapse)
+        if replaced:
+            self.logger.debug(f"Autelis {comGroup} {param}={value} replaces a command not sent yet")
+            self.metrics.count("autelis.commandsCollapsed")
+        future.add_done_callback(lambda done: self.autelisOutcome(action, done))
+        return future
+
+    def autelisOutcome(self, action, future):
+        # Log how an action's Autelis command went: sent (and how long it took), failed, or dropped unsent.
+        if future.cancelled():
+            self.logger.warning(f"{action}: not sent, the controller was restarted")
+            return
+        success, latency = future.result()
+        if success:
+            self.logger.info(f"{action}: done in {latency * 1000:.0f} ms")
+        else:
+            self.logger.error(f"{action}: Autelis command failed after {latency * 1000:.0f} ms")
+
+    def autelisSend(self, target, value, futures, queued):
+        # Runs on a poll worker: send one dispatcher command and report the outcome to everyone waiting on it.
+        comGroup, circuit, param = target
         if comGroup == "set":
             payload = {'name': circuit, param: value}
         else:
             payload = {param: value}
-        req = requests.get(url, params=payload, auth=('admin', self.pluginPrefs['autpwd']))
-        response = req.text
-        self.logger.debug("Command sent to Autellis. Response: " + response)
+        try:
+            with self.metrics.timer("autelis.command"):
+                req = self.autelisGet(comGroup + ".cgi", params=payload)
+            latency = time.time() - queued
+            success = req is not None and req.ok
+            if success:
+                self.logger.debug(f"Command sent to Autelis in {latency * 1000:.0f} ms. Response: {req.text}")
+            else:
+                self.logger.debug(f"Autelis {comGroup} command {param}={value} failed")
+                self.metrics.count("autelis.commandsFailed")
+            self.metrics.record("autelis.commandLatency", latency)
+            for future in futures:
+                future.set_result((success, latency))
+        finally:
+            self.autelisCommands.done()
+            # in push mode the panel reports circuit changes itself; only chlorinator settings still need a poll
+            if not self.pushActive():
+                self.poller.expedite(time.time())
+            elif comGroup == "chlor":
+                self.poller.expedite(time.time(), names=("chlor",))
+            self.wake()
 
     def autelisProcessNames(self):
-        # get the names.xml file from the Autelis Interface and assign to inputs
+        # get the names.xml file from the Autelis Interface and cache the names of the circuits the panel has,
+        # keyed by circuit code (<aux7>WATERFALL</aux7> -> AUX7: WATERFALL). POOL and SPA are always there.
         self.logger.debug("Loading names file from Autelis Interface...")
-        xmlset = "names"
-        url = "http://" + self.autelisIP + "/" + xmlset + ".xml"
-        req = requests.get(url, auth=('admin', self.pluginPrefs['autpwd']))
-        autdata = ET.XML(req.text)
-        for child in autdata.find('equipment'):
-            self.system_names[child.tag] = child.text
-
-    def autelisProcessStatus(self):
-        # get the status.xml file from the Autelis Interface and parse system node to devices
+        try:
+            req = self.autelisGet("names.xml", stream=True)
+            if req is None:
+                return
+            with req:
+                sections = parseAutelisStream(req.iter_content(kAutelisChunk), kAutelisSections["names"])
+        except ET.ParseError as err:
+            self.logger.warning(f"Could not parse names.xml: {err}")
+            return
+        finally:
+            self.namesRefreshing = False
+        if "equipment" not in sections:
+            return
+        names = {}
+        for tag, text in sections["equipment"].items():
+            aux = re.match(r"aux(\d+)$", tag)
+            text = (text or "").strip()
+            if aux and text.upper() not in kUnusedNames:
+                names["AUX" + aux.group(1)] = text
+        names = dict(sorted(names.items(), key=lambda item: int(item[0][3:])))
+        names["POOL"] = "POOL"
+        names["SPA"] = "SPA"
+        self.system_names = names
+        self.namesFetched = time.time()
+        self.savePref("circuitNames", json.dumps({"fetched": self.namesFetched, "names": names}))
+        self.logger.debug(f"Found {len(names)} circuits in names.xml")
+
+    def loadCircuitNames(self):
+        # Pick up the circuit names cached in the plugin prefs by an earlier run.
+        try:
+            cached = json.loads(self.pluginPrefs.get("circuitNames", "{}"))
+        except ValueError:
+            cached = {}
+        self.system_names = cached.get("names", {})
+        self.namesFetched = cached.get("fetched", 0)
+
+    def circuitNames(self, wait=False):
+        # The discovered circuits (code -> name), or {} if names are unavailable (iLink interface, nothing fetched yet).
+        # Stale names are refreshed on a poll worker; wait=True refreshes them before returning.
+        if self.pluginPrefs.get('interface') != 'autelis':
+            return {}
+        if time.time() - self.namesFetched > kNamesTTL:
+            if wait:
+                self.autelisProcessNames()
+            elif not self.namesRefreshing:
+                self.namesRefreshing = True
+                if self.submitPoll(self.autelisProcessNames) is None:
+                    self.namesRefreshing = False
+        return self.system_names
+
+    def autelisFetch(self, xmlset):
+        # Fetch an Autelis document on a poll worker, streaming it through parseAutelisStream and handing each mapped
+        # section back to the concurrent thread as soon as it has been read.
+        # A snapshot younger than the freshness window is served without any HTTP traffic, and otherwise the fetch is
+        # conditional (ETag / Last-Modified). The lock only guards the snapshot table, never the HTTP request itself.
+        with self.snapshotLock:
+            snapshot = self.autelisSnapshots.get(xmlset)
+        now = time.time()
+        if snapshot is not None and now - snapshot['fetched'] < self.snapshotAge:
+            self.metrics.count("http.snapshotHits")
+            self.autelisDeliver(xmlset, snapshot['sections'])
+            return
+
+        headers = {}
+        if snapshot is not None:
+            if snapshot['etag']:
+                headers['If-None-Match'] = snapshot['etag']
+            if snapshot['modified']:
+                headers['If-Modified-Since'] = snapshot['modified']
+        fetchStart = time.perf_counter()
+        req = self.autelisGet(xmlset + ".xml", headers=headers, stream=True)
+        if req is None:
+            return
+        with req:
+            if req.status_code == 304 and snapshot is not None:
+                self.logger.debug("%s.xml not modified", xmlset)
+                self.metrics.count("http.notModified")
+                snapshot['fetched'] = now
+                self.autelisDeliver(xmlset, snapshot['sections'])
+                return
+            sections = parseAutelisStream(req.iter_content(kAutelisChunk), kAutelisSections[xmlset],
+                                          lambda name, values: self.events.put(("section", name, values)))
+        self.metrics.record("http.fetch." + xmlset, time.perf_counter() - fetchStart)
+        with self.snapshotLock:
+            self.autelisSnapshots[xmlset] = {
+                'sections': sections,
+                'fetched': now,
+                'etag': req.headers.get('ETag'),
+                'modified': req.headers.get('Last-Modified')
+            }
+
+    def autelisDeliver(self, xmlset, sections):
+        # Hand already decoded sections to the concurrent thread.
+        for name, values in sections.items():
+            self.events.put(("section", name, values))
+
+    def autelisRequestPoll(self, xmlset, force=False):
+        # Queue a background fetch of an Autelis document. A request for a document that is already being fetched
+        # is merged into the pending one. force makes the decoders run even if the document has not changed; if the
+        # merged fetch may already have delivered its sections, they are delivered again once it completes.
+        with self.pollLock:
+            if force:
+                for name in kAutelisSections[xmlset]:
+                    self.autelisDecoded.pop(name, None)
+            if xmlset in self.pollsInFlight:
+                self.pollsInFlight[xmlset] = self.pollsInFlight[xmlset] or force
+                return
+            self.pollsInFlight[xmlset] = False
+        future = self.submitPoll(self.autelisFetch, xmlset)
+        if future is None:
+            with self.pollLock:
+                self.pollsInFlight.pop(xmlset, None)
+            return
+        future.add_done_callback(lambda f: self.events.put(("done", xmlset, f)))
+
+    def submitPoll(self, fn, *args):
+        # Run fn on a poll worker. Returns its Future, or None if there are no workers (not started, or stopped).
+        executor = self.pollExecutor
+        if executor is None:
+            return None
+        try:
+            return executor.submit(fn, *args)
+        except RuntimeError:
+            # shut down by stop() or a restart
+            return None
+
+    def autelisFetchDone(self, xmlset, future):
+        # A background fetch has finished (its sections were already delivered). Runs on the concurrent thread only.
+        with self.pollLock:
+            redeliver = self.pollsInFlight.pop(xmlset, False)
+        self.startupSyncDone(xmlset + ".xml")
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.logger.error(f"Error fetching {xmlset}.xml from Autelis: {future.exception()}")
+            return
+        if redeliver:
+            with self.snapshotLock:
+                snapshot = self.autelisSnapshots.get(xmlset)
+            if snapshot is not None:
+                for name, values in snapshot['sections'].items():
+                    self.autelisProcessSection(name, values)
+
+    def autelisStreamChange(self, code):
+        # A value pushed on the Autelis socket has changed. The cached section holding it is out of date: drop it, so
+        # the next fetch is requested and decoded in full. Changes that also affect values the socket never reports
+        # bring the next status.xml poll forward.
+        self.metrics.count("push.changes")
+        section = kStreamSections.get(code)
+        if section is not None:
+            with self.pollLock:
+                self.autelisDecoded.pop(section, None)
+            with self.snapshotLock:
+                for snapshot in self.autelisSnapshots.values():
+                    if section in snapshot['sections']:
+                        snapshot['fetched'] = 0
+        if code in kReconcileCodes:
+            self.metrics.count("push.reconciles")
+            self.poller.expedite(time.time(), names=("temp",))
+
+    def autelisProcessSection(self, name, values):
+        if name == "system":
+            self.autelisProcessStatus(values)
+        elif name == "temp":
+            self.autelisProcessTemp(values)
+        elif name == "chlor":
+            self.autelisProcessChem(values)
+
+    def autelisChanged(self, node, values):
+        # True if the node's values differ from the ones last decoded (or a refresh has been forced).
+        with self.pollLock:
+            changed = self.autelisDecoded.get(node) != values
+            self.autelisDecoded[node] = values
+        self.poller.observed(node, changed, time.time())
+        if not changed:
+            self.logger.debug("No changes to %s node since last update", node)
+        return changed
+
+    def autelisSampleHistory(self, node, values):
+        # An unchanged node isn't decoded again, but a steady reading is still a history sample: feed the series
+        # straight from the node's raw values.
+        with self.stateLock:
+            for tag, text in values.items():
+                if node == "temp":
+                    circuitcode, statecode = self.autelisTempMap.get(tag, (None, None))
+                else:
+                    circuitcode, statecode = "SYSTEM", self.autelisStateMap.get(tag)
+                if (circuitcode, statecode) not in self.historyKeys or circuitcode not in self.circuit_dev:
+                    continue
+                try:
+                    value = int(text)
+                except (TypeError, ValueError):
+                    continue
+                self.recordHistory(circuitcode, statecode, 50 * value if statecode == "salt" else value)
+
+    def autelisProcessStatus(self, values):
+        # parse the system node of the Autelis status.xml file to devices
         self.logger.debug("Processing system node from Autelis Status.xml...")
-        xmlset = "status"
-        url = "http://" + self.autelisIP + "/" + xmlset + ".xml"
-        req = requests.get(url, auth=('admin', self.pluginPrefs['autpwd']))
-        autdata = ET.XML(req.text)
+        if not self.autelisChanged("system", values):
+            return
         if "SYSTEM" in self.circuit_dev:
             self.logger.debug("'System' Device Available")
-            dev = indigo.devices[self.circuit_dev["SYSTEM"]]
-            for child in autdata.find('system'):
-                if child.tag in self.autelisStateMap:
-                    statecode = self.autelisStateMap[child.tag]
-                    repvalue = child.text
+            dev = self.circuit_dev["SYSTEM"]
+            for tag, text in values.items():
+                if tag in self.autelisStateMap:
+                    statecode = self.autelisStateMap[tag]
+                    repvalue = text
                     if statecode == "readystate":
                         repvalue = self.autelisRunstate(repvalue)
                     elif statecode == "model":
                         repvalue = self.modelList[int(repvalue)]
                     elif statecode == "opmode":
                         repvalue = self.opMode[int(repvalue)]
-                    elif child.tag[:6] == "sensor":
+                    elif tag[:6] == "sensor":
                         repvalue = self.okErr[int(repvalue)]
-                    curstate = dev.states[statecode]
-                    if curstate == repvalue:
-                        self.logger.debug(dev.name + ": " + statecode + " is " + repvalue)
+                    if self.queueState("SYSTEM", statecode, repvalue):
+                        self.logger.info("%s: %s is %s", dev.name, statecode, repvalue)
                     else:
-                        dev.updateStateOnServer(statecode, value=repvalue)
-                        self.logger.info(dev.name + ": " + statecode + " is " + repvalue)
+                        self.logger.debug("%s: %s is %s", dev.name, statecode, repvalue)
         else:
             self.logger.debug("No 'System' Device Defined")
-        self.next_refresh = time.time() + (60 * float(self.pluginPrefs['statusPoll']))
 
-    def autelisProcessTemp(self):
-        # get the status.xml file from the Autelis Interface and parse temp node to devices
+    def autelisProcessTemp(self, values):
+        # parse the temp node of the Autelis status.xml file to devices
         self.logger.debug("Processing temp node from Autelis Status.xml...")
-        xmlset = "status"
-        url = "http://" + self.autelisIP + "/" + xmlset + ".xml"
-        req = requests.get(url, auth=('admin', self.pluginPrefs['autpwd']))
-        autdata = ET.XML(req.text)
-        for child in autdata.find('temp'):
-            if child.text is None:
+        if not self.autelisChanged("temp", values):
+            self.autelisSampleHistory("temp", values)
+            return
+        for tag, text in values.items():
+            if text is None:
                 pass
             else:
-                if child.tag in self.autelisTempMap:
-                    circuitcode = self.autelisTempMap[child.tag][0]
-                    statecode = self.autelisTempMap[child.tag][1]
-                    repvalue = int(child.text)
-                    if child.tag == 'pooltemp':
+                if tag in self.autelisTempMap:
+                    circuitcode = self.autelisTempMap[tag][0]
+                    statecode = self.autelisTempMap[tag][1]
+                    repvalue = int(text)
+                    if tag == 'pooltemp':
                         self.curTemp = repvalue
-                    if child.tag == 'htstatus':
+                    if tag == 'htstatus':
                         # the heater status item carries information for multiple device, so it has to
                         # be pulled out and handled on its own.
-                        stateDict = self.decodeHeatStatus(child.text)
+                        stateDict = self.decodeHeatStatus(text)
                         for circuit in stateDict:
-                            if circuit in self.circuit_dev:
-                                dev = indigo.devices[self.circuit_dev[circuit]]
-                                repvalue = stateDict[circuit]
-                                dev.updateStateOnServer(statecode, value=repvalue)
+                            self.queueState(circuit, statecode, stateDict[circuit])
                     elif circuitcode in self.circuit_dev:
-                        dev = indigo.devices[self.circuit_dev[circuitcode]]
-                        curstate = dev.states[statecode]
-                        if curstate == repvalue:
-                            self.logger.debug(dev.name + ": " + statecode + " is " + str(repvalue))
+                        dev = self.circuit_dev[circuitcode]
+                        if self.queueState(circuitcode, statecode, repvalue):
+                            self.logger.info("%s: %s is %s", dev.name, statecode, repvalue)
                         else:
-                            dev.updateStateOnServer(statecode, value=repvalue)
-                            self.logger.info(dev.name + ": " + statecode + " is " + str(repvalue))
+                            self.logger.debug("%s: %s is %s", dev.name, statecode, repvalue)
 
-    def autelisProcessChem(self):
-        # get the status.xml file from the Autelis Interface and parse system node to devices
+    def autelisProcessChem(self, values):
+        # parse the chlor node of the Autelis chem.xml file to devices
         self.logger.debug("Processing chlor node from Autelis Chem.xml...")
-        xmlset = "chem"
-        url = "http://" + self.autelisIP + "/" + xmlset + ".xml"
-        req = requests.get(url, auth=('admin', self.pluginPrefs['autpwd']))
-        autdata = ET.XML(req.text)
+        if not self.autelisChanged("chlor", values):
+            self.autelisSampleHistory("chlor", values)
+            return
         if "SYSTEM" in self.circuit_dev:
             self.logger.debug("'System' Device Available")
-            dev = indigo.devices[self.circuit_dev["SYSTEM"]]
-            for child in autdata.find('chlor'):
-                self.logger.debug("Child: " + str(child.tag))
-                if child.tag in self.autelisStateMap:
-                    self.logger.debug(str(child.tag) + " found in autelisStateMap")
-                    statecode = self.autelisStateMap[child.tag]
-                    repvalue = child.text
+            dev = self.circuit_dev["SYSTEM"]
+            for tag, text in values.items():
+                self.logger.debug("Child: %s", tag)
+                if tag in self.autelisStateMap:
+                    self.logger.debug("%s found in autelisStateMap", tag)
+                    statecode = self.autelisStateMap[tag]
+                    repvalue = text
                     if statecode == "salt":
                         repvalue = 50 * int(repvalue)
                         adjsalt = repvalue - ((self.curTemp - 77) * 40)
-                        if dev.states["temp_corr_salt"] == adjsalt:
-                            self.logger.debug(dev.name + ": Temp Corrected Salt Level is " + str(adjsalt))
+                        if self.queueState("SYSTEM", "temp_corr_salt", adjsalt):
+                            self.logger.info("%s: Temp Corrected Salt Level is %s", dev.name, adjsalt)
                         else:
-                            dev.updateStateOnServer("temp_corr_salt", value=adjsalt)
-                            self.logger.info(dev.name + ": Temp Corrected Salt Level is " + str(adjsalt))
+                            self.logger.debug("%s: Temp Corrected Salt Level is %s", dev.name, adjsalt)
                     elif statecode == "chlorname":
-                        repvalue = child.text
+                        repvalue = text
                     elif statecode == "chlorerr":
-                        repvalue = self.decodeChlorErr(child.text)
+                        repvalue = self.decodeChlorErr(text)
                     else:
                         repvalue = int(repvalue)
-                    curstate = dev.states[statecode]
-                    if curstate == repvalue:
-                        self.logger.debug(dev.name + ": " + statecode + " is " + str(repvalue))
+                    if self.queueState("SYSTEM", statecode, repvalue):
+                        self.logger.info("%s: %s is %s", dev.name, statecode, repvalue)
                     else:
-                        dev.updateStateOnServer(statecode, value=repvalue)
-                        self.logger.info(dev.name + ": " + statecode + " is " + str(repvalue))
+                        self.logger.debug("%s: %s is %s", dev.name, statecode, repvalue)
         else:
             self.logger.debug("No 'System' Device Defined")
-        # Save a timestamp for when this was last run, so that it can periodically be re-run.
-        self.refreshChem = round(time.time(), 0) + (60 * float(self.pluginPrefs['chemPoll']))
 
     def decodeHeatStatus(self, value):
         state = (False, True)
@@ -580,7 +2316,7 @@ class Plugin(indigo.PluginBase):
         rstates = {}
         for bit in range(0, 4):
             rstates[circuitcodes[bit]] = state[int(padded[bit])]
-            self.logger.debug(circuitcodes[bit] + ": " + str(rstates[circuitcodes[bit]]))
+            self.logger.debug("%s: %s", circuitcodes[bit], rstates[circuitcodes[bit]])
 
         return rstates
 
@@ -596,7 +2332,7 @@ class Plugin(indigo.PluginBase):
             state = "No errors"
         else:
             state = state[2:]
-        self.logger.debug("Chlorinator Errors: " + state)
+        self.logger.debug("Chlorinator Errors: %s", state)
 
         return state
 
@@ -608,3 +2344,357 @@ class Plugin(indigo.PluginBase):
             rval = "service"
 
         return rval
+
+
+##################################################################################################
+class Plugin(indigo.PluginBase):
+
+    ##############################################################################################
+    # Required Methods
+    ##############################################################################################
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
+        if 'showDebugInfo' in pluginPrefs:
+            self.debug = pluginPrefs['showDebugInfo']
+        else:
+            self.debug = False
+        self.logTemps = False
+
+        # Logging pipeline, see startLogging: records below the logger's level are never built, repeats are dropped by
+        # logFilter, and the rest are written to Indigo's handlers on a writer thread.
+        self.logStats = Metrics()
+        self.logFilter = RepeatFilter(prefNumber(pluginPrefs, 'logRepeatWindow', kLogRepeatWindow), self.logStats)
+        self.logHandler = None
+        self.logWriter = None
+        self.logHandlers = []
+        self.configureLogging(pluginPrefs)
+
+        # Controllers by id: 0 is the default one, configured in the plugin prefs; the others are 'controller' devices,
+        # keyed by device id. Devices and actions name theirs in a 'controller' prop (missing or "0" for the default).
+        self.controllers = {0: Controller(self, 0, "Default", pluginPrefs)}
+
+    ##############################################################################################
+    # Non-Required Methods (but still defined by Indigo)
+    ##############################################################################################
+    def startup(self):
+        self.startLogging()
+        self.controllers[0].start()
+
+    def shutdown(self):
+        # controller devices have already been stopped by deviceStopComm
+        for controller in list(self.controllers.values()):
+            if controller.running:
+                controller.stop()
+        self.stopLogging()
+
+    def validateDeviceConfigUi(self, valuesDict, typeId, devId):
+        # Validate that appropriate selections were made in device creation / modification dialogs.
+        # Ensure that Zone is not already used on the same controller
+        errorsDict = indigo.Dict()
+        if typeId == "controller":
+            self.validateSerialPortUi(valuesDict, errorsDict, "serialport")
+            self.validateNumbersUi(valuesDict, errorsDict)
+        else:
+            circuit = valuesDict["circuitselect"]
+            controller = self.controllerFor(valuesDict)
+            self.logger.debug(f"Circuit Selected: {circuit} on {controller.name}")
+            self.logger.debug("Validating Device")
+            if circuit in controller.circuit_dev and controller.circuit_dev[circuit].id != devId:
+                errorsDict["circuitselect"] = "Circuit Already Assigned to Device"
+            else:
+                self.logger.debug("Circuit Available")
+
+        if len(errorsDict) > 0:
+            return False, valuesDict, errorsDict
+        return True, valuesDict
+
+    # This section creates entries and deletes entries in each controller's dictionary of
+    # AUXx , dev in an effort help find devices simply by what zone they control.
+    def deviceStartComm(self, dev):
+        self.logger.debug("deviceStartComm called")
+        if dev.deviceTypeId == "controller":
+            controller = self.controllers.get(dev.id)
+            if controller is None:
+                controller = self.addController(dev)
+            controller.attach(dev)
+            controller.start()
+            return
+
+        circuitcode = dev.pluginProps["circuitselect"]
+        if not dev.address or dev.address == "":
+            newProps = dev.pluginProps
+            newProps.update({"address": circuitcode})
+            dev.replacePluginPropsOnServer(newProps)
+        self.controllerFor(dev.pluginProps).addDevice(dev)
+
+    def deviceStopComm(self, dev):
+        if dev.deviceTypeId == "controller":
+            # the controller keeps its devices, in case it's only being restarted with new settings
+            if dev.id in self.controllers:
+                self.controllers[dev.id].stop()
+            return
+        self.controllerFor(dev.pluginProps).removeDevice(dev)
+
+    def deviceDeleted(self, dev):
+        indigo.PluginBase.deviceDeleted(self, dev)
+        if dev.pluginId == self.pluginId and dev.deviceTypeId == "controller":
+            # its circuit devices now fall back to the default controller (see controllerFor)
+            controller = self.controllers.pop(dev.id, None)
+            if controller is not None and controller.running:
+                controller.stop()
+
+    def deviceUpdated(self, origDev, newDev):
+        indigo.PluginBase.deviceUpdated(self, origDev, newDev)
+        if newDev.pluginId != self.pluginId or newDev.deviceTypeId == "controller":
+            return
+        self.controllerFor(newDev.pluginProps).updateDevice(newDev)
+
+    def didDeviceCommPropertyChange(self, origDev, newDev):
+        # Only a change to a setting restarts a device; values the plugin caches in its props don't.
+        keys = set(origDev.pluginProps) | set(newDev.pluginProps)
+        return any(origDev.pluginProps.get(key) != newDev.pluginProps.get(key) for key in keys if key not in kCachedProps)
+
+    def validatePrefsConfigUi(self, valuesDict):
+
+        errorsDict = indigo.Dict()
+        self.logger.debug("Validating Serial Port")
+        self.validateSerialPortUi(valuesDict, errorsDict, "serialport")
+        self.validateNumbersUi(valuesDict, errorsDict)
+
+        if len(errorsDict) > 0:
+            return False, valuesDict, errorsDict
+        return True, valuesDict
+
+    def validateNumbersUi(self, valuesDict, errorsDict):
+        # The numeric settings a dialog has must be numbers, zero or more.
+        for key in kNumericPrefs:
+            if key not in valuesDict:
+                continue
+            try:
+                valid = float(valuesDict[key]) >= 0
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                errorsDict[key] = "Enter a number, zero or more"
+
+    def closedPrefsConfigUi(self, valuesDict, userCancelled):
+        self.logger.debug("closedPrefsConfigUI() called")
+        if not userCancelled:
+            if valuesDict['showDebugInfo']:
+                self.debug = True
+            else:
+                self.debug = False
+
+            if valuesDict['logTemps']:
+                self.logTemps = True
+            else:
+                self.logTemps = False
+            self.configureLogging(valuesDict)
+
+            self.controllers[0].start()
+
+    def runConcurrentThread(self):
+        # Every controller does its I/O on its own thread (Controller.run). This thread only watches over them, and
+        # restarts a controller thread that ended on an unexpected error.
+        try:
+            while True:
+                for controller in list(self.controllers.values()):
+                    if controller.running and not controller.thread.is_alive():
+                        self.logger.warning(f"Restarting the thread for controller {controller.name}")
+                        controller.startThread()
+                self.sleep(kSuperviseInterval)
+        except self.StopThread:
+            pass
+
+    ##############################################################################################
+    # Logging
+    ##############################################################################################
+    def configureLogging(self, prefs):
+        # The logger's own level decides whether a message is built at all, so debug messages cost next to nothing
+        # while debug logging is off.
+        self.logger.setLevel(logging.DEBUG if prefs.get('showDebugInfo') else logging.INFO)
+        self.logFilter.window = prefNumber(prefs, 'logRepeatWindow', kLogRepeatWindow)
+
+    def startLogging(self):
+        # Move Indigo's log handlers behind a queue, so event log I/O happens on a writer thread instead of the
+        # serial and HTTP threads.
+        if self.logWriter is not None or not self.logger.handlers:
+            return
+        logQueue = queue.SimpleQueue()
+        self.logHandlers = list(self.logger.handlers)
+        self.logHandler = LogQueueHandler(logQueue, self.logStats)
+        self.logHandler.addFilter(self.logFilter)
+        self.logWriter = LogWriter(logQueue, self.logStats, self.logHandlers)
+        for handler in self.logHandlers:
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.logHandler)
+        self.logWriter.start()
+
+    def stopLogging(self):
+        # Write out whatever is still queued and give Indigo's handlers back to the logger.
+        if self.logWriter is None:
+            return
+        self.logWriter.stop()
+        self.logger.removeHandler(self.logHandler)
+        for handler in self.logHandlers:
+            self.logger.addHandler(handler)
+        self.logWriter = None
+        self.logHandler = None
+
+    def logTime(self):
+        # Seconds the calling thread has spent logging since it last asked.
+        return self.logHandler.take() if self.logHandler is not None else 0.0
+
+    ##############################################################################################
+    # Controllers
+    ##############################################################################################
+    def addController(self, dev):
+        controller = Controller(self, dev.id, dev.name, dict(dev.pluginProps), dev)
+        self.controllers[dev.id] = controller
+        return controller
+
+    def controllerFor(self, props):
+        # The controller a device or action belongs to, from the 'controller' entry of its props.
+        controllerId = int(props.get("controller") or 0)
+        controller = self.controllers.get(controllerId)
+        if controller is None:
+            # a device starting before its controller device: set the controller up now, it starts with its device
+            if controllerId not in indigo.devices:
+                self.logger.error(f"Controller {controllerId} doesn't exist, using the default controller")
+                return self.controllers[0]
+            controller = self.addController(indigo.devices[controllerId])
+        return controller
+
+    def actionController(self, props):
+        # The controller to carry out an action, or None (and an error logged) if it isn't running: its device is
+        # disabled or has been deleted. Actions are never passed on to another panel's controller.
+        controllerId = int(props.get("controller") or 0)
+        controller = self.controllers.get(controllerId)
+        if controller is None or not controller.running:
+            name = controller.name if controller is not None else f"Controller {controllerId}"
+            self.logger.error(f"{name} isn't running, action not carried out")
+            return None
+        return controller
+
+    def genControllerList(self, filter, valuesDict, typeID, targetID):
+        controllerList = [("0", "Default (Plugin Settings)")]
+        for dev in indigo.devices.iter("self.controller"):
+            controllerList.append((str(dev.id), dev.name))
+        return controllerList
+
+    def controllerChanged(self, valuesDict, typeId=None, devId=None):
+        # Picking another controller reloads the circuit menu with that panel's circuits.
+        return valuesDict
+
+    ##############################################################################################
+    # Actions and menu items, carried out by the controller the device or action belongs to
+    ##############################################################################################
+    def actionControlDimmerRelay(self, action, dev):
+        controller = self.actionController(dev.pluginProps)
+        if controller is not None:
+            controller.actionControlDimmerRelay(action, dev)
+
+    def actionControlThermostat(self, action, dev):
+        controller = self.actionController(dev.pluginProps)
+        if controller is not None:
+            controller.actionControlThermostat(action, dev)
+
+    def setSetPoint(self, pluginAction, dev):
+        controller = self.actionController(dev.pluginProps)
+        if controller is not None:
+            controller.setSetPoint(pluginAction, dev)
+
+    def setCircuits(self, pluginAction):
+        controller = self.actionController(pluginAction.props)
+        if controller is not None:
+            controller.setCircuits(pluginAction)
+
+    def intellibriteOn(self, pluginAction):
+        controller = self.actionController(pluginAction.props)
+        if controller is not None:
+            controller.intellibriteOn(pluginAction)
+
+    def intellibriteOff(self, pluginAction):
+        controller = self.actionController(pluginAction.props)
+        if controller is not None:
+            controller.intellibriteOff(pluginAction)
+
+    def setIntellibriteMode(self, pluginAction):
+        controller = self.actionController(pluginAction.props)
+        if controller is not None:
+            controller.setIntellibriteMode(pluginAction)
+
+    def superChlor(self, pluginAction):
+        controller = self.actionController(pluginAction.props)
+        if controller is not None:
+            controller.superChlor(pluginAction)
+
+    def adjChlor(self, pluginAction):
+        controller = self.actionController(pluginAction.props)
+        if controller is not None:
+            controller.adjChlor(pluginAction)
+
+    def logMetrics(self):
+        for controller in list(self.controllers.values()):
+            controller.logMetrics()
+        for line in self.logStats.summary():
+            self.logger.info(line)
+
+    def logPollStats(self):
+        for controller in list(self.controllers.values()):
+            controller.logPollStats()
+
+    def genAuxCircuitList(self, filter, valuesDict, typeID, targetID):
+        # method to generate lists with names/labels.
+        # With an Autelis interface only the circuits the panel has are listed, under their real names. Otherwise (or
+        # until names.xml has been read) all of AUX1-AUX50, POOL and SPA are offered.
+        names = self.controllerFor(valuesDict).circuitNames()
+        if names:
+            auxList = [(code, name if name == code else f"{name} ({code})") for code, name in names.items()]
+            current = valuesDict.get("circuitselect")
+            if current and current not in names:
+                auxList.append((current, current))
+        else:
+            auxList = []
+            for cir in range(1, 51):
+                pname = "AUX" + str(cir)
+                auxList.append((pname, pname))
+            auxList.append(("POOL", "POOL"))
+            auxList.append(("SPA", "SPA"))
+        self.logger.debug(f"genAuxCircuitList: {auxList}")
+        return auxList
+
+    def createCircuitDevices(self):
+        # Menu item: create a circuit device for every discovered circuit, on every controller, that doesn't have one yet.
+        existing = {(int(dev.pluginProps.get("controller") or 0), dev.pluginProps.get("circuitselect"))
+                    for dev in indigo.devices.iter("self")}
+        taken = {dev.name for dev in indigo.devices}
+        for controller in list(self.controllers.values()):
+            if not controller.running:
+                continue
+            names = controller.circuitNames(wait=True)
+            if not names:
+                if controller.pluginPrefs.get('interface') == 'autelis':
+                    controller.logger.error("No circuit names available from the Autelis interface, no devices created")
+                else:
+                    # the iLink adapter can't tell which circuits the panel has, or their names
+                    controller.logger.error("The iLink adapter doesn't report the panel's circuits, so devices can't "
+                                            "be created automatically. Add a Pentair circuit device for each one instead")
+                continue
+            created = 0
+            for code, name in names.items():
+                if (controller.id, code) in existing:
+                    continue
+                devName = name.title()
+                if devName in taken:
+                    devName = f"{devName} ({code})" if controller.dev is None else f"{devName} ({controller.name} {code})"
+                try:
+                    indigo.device.create(protocol=indigo.kProtocol.Plugin, name=devName, address=code,
+                                         deviceTypeId="circuit",
+                                         props={"controller": str(controller.id), "circuitselect": code, "address": code})
+                except Exception as err:
+                    controller.logger.error(f"Could not create a device for {code}: {err}")
+                    continue
+                taken.add(devName)
+                created += 1
+            controller.logger.info(f"Created {created} circuit devices, {len(names) - created} circuits already had one")
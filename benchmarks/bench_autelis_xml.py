@@ -0,0 +1,68 @@
+# Benchmark for decoding Autelis XML. Compares the old whole-document path (ET.XML + find) with parseAutelisStream
+# on the recorded documents in samples/. Reports time per document and peak memory for each, and how much of the
+# document the streaming decoder has to read before the first section can be applied to devices.
+#
+#   python benchmarks/bench_autelis_xml.py [path/to/plugin.py]
+
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import fake_indigo
+
+kSamples = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
+kIterations = 2000
+
+
+def wholeDocument(chunks, sections):
+    # what the plugin did before: buffer the full response, build the tree, then pull out each section
+    autdata = ET.XML(b"".join(chunks))
+    return {name: {child.tag: child.text for child in autdata.find(name)} for name in sections}
+
+
+def measure(decode, chunks, sections):
+    start = time.perf_counter()
+    for _ in range(kIterations):
+        decode(chunks, sections)
+    elapsed = (time.perf_counter() - start) / kIterations
+    tracemalloc.start()
+    decode(chunks, sections)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def firstSection(module, chunks, sections):
+    # bytes read when the streaming decoder delivers its first section
+    received = []
+    delivered = []
+
+    def counted():
+        for chunk in chunks:
+            received.append(len(chunk))
+            yield chunk
+
+    module.parseAutelisStream(counted(), sections, lambda name, values: delivered.append(sum(received)))
+    return delivered[0] if delivered else sum(received)
+
+
+def main():
+    logging.basicConfig(level=logging.CRITICAL)
+    plugin = fake_indigo.loadPlugin({'interface': 'autelis', 'serialport': ''}, *sys.argv[1:])
+    module = sys.modules[type(plugin).__module__]
+    for xmlset, sections in sorted(module.kAutelisSections.items()):
+        with open(os.path.join(kSamples, xmlset + ".xml"), "rb") as sample:
+            document = sample.read()
+        chunks = [document[i:i + module.kAutelisChunk] for i in range(0, len(document), module.kAutelisChunk)]
+        assert wholeDocument(chunks, sections) == module.parseAutelisStream(chunks, sections)
+        for label, decode in (("ET.XML + find", wholeDocument), ("streaming", module.parseAutelisStream)):
+            elapsed, peak = measure(decode, chunks, sections)
+            print(f"{xmlset + '.xml':11} {label:14} {elapsed * 1e6:8.1f} us/doc  peak {peak / 1024:6.1f} KiB")
+        print(f"{xmlset + '.xml':11} first section after {firstSection(module, chunks, sections)} of {len(document)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Micro-benchmark for parse_ilink: decodes a recorded mix of iLink frames against all 52 circuits plus heaters
+# and reports lines/second.
+#
+#   python benchmarks/bench_ilink_parse.py [path/to/plugin.py]
+#
+# Pass the plugin.py of an older revision (e.g. extracted with 'git show') to compare before and after.
+
+import logging
+import os
+import sys
+import time
+
+import fake_indigo
+
+kCircuits = ["AUX" + str(cir) for cir in range(1, 51)] + ["POOL", "SPA"]
+kPasses = 200
+kRepeats = 5
+
+
+def recordedFrames():
+    # One refresh worth of traffic: every circuit echoing twice (one change, one repeat), heater and system values,
+    # plus the odd error reply.
+    frames = []
+    for state in ("1", "0"):
+        for circuit in kCircuits:
+            code = "PUMP" if circuit == "POOL" else circuit
+            frames.append(f"!00 {code} = {state}")
+            frames.append(f"!00 {code} = {state}")
+    frames += ["!00 POOLHT = 1", "!00 POOLSP = 82", "!00 POOLTMP = 79", "!00 SPAHT = 0", "!00 SPASP = 102",
+               "!00 SPATMP = 98", "!00 AIRTMP = 71", "!00 OPMODE = AUTO", "?02 SYNTAX ERROR"]
+    return frames
+
+
+def main():
+    logging.basicConfig(level=logging.CRITICAL)
+    # as under Indigo: the plugin logger passes everything, its handler shows info and up (here into nowhere)
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setLevel(logging.INFO)
+    logger = logging.getLogger("Plugin")
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    args = sys.argv[1:]
+    plugin = fake_indigo.loadPlugin({'interface': 'ilink', 'serialport': ''}, *args)
+    getattr(plugin, "startLogging", lambda: None)()
+    for dev in fake_indigo.makeDevices(kCircuits):
+        plugin.deviceStartComm(dev)
+    # the default controller parses the frames (the plugin itself, before controllers existed)
+    engine = getattr(plugin, "controllers", {0: plugin})[0]
+    flush = getattr(engine, "flushStates", lambda: None)
+    frames = recordedFrames()
+
+    # best of kRepeats, with queued state writes flushed once per pass as the concurrent thread would
+    best = None
+    for _ in range(kRepeats):
+        start = time.perf_counter()
+        for _ in range(kPasses):
+            for frame in frames:
+                engine.parse_ilink(frame)
+            flush()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    lines = kPasses * len(frames)
+    print(f"parse_ilink: {lines} lines in {best:.3f} s = {lines / best:,.0f} lines/s")
+    getattr(plugin, "stopLogging", lambda: None)()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Minimal stand-in for the parts of Indigo's 'indigo' module the Pentair plugin uses, so the plugin can be loaded
+# and driven on a machine without an Indigo server (benchmarks only - nothing here ships with the plugin).
+
+import builtins
+import importlib.util
+import logging
+import os
+import sys
+import time
+import types
+
+import serial
+
+PLUGIN_ID = "com.jeremyswancoat.indigoplugin.pentairpool"
+PLUGIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                           "Pentair Pool.indigoPlugin", "Contents", "Server Plugin", "plugin.py")
+
+
+class Dict(dict):
+    pass
+
+
+class FakeDevice(object):
+    # Device copy as handed to the plugin by Indigo. Counts the server writes made through it.
+
+    def __init__(self, devId, name, deviceTypeId, circuit, states=None):
+        self.id = devId
+        self.name = name
+        self.deviceTypeId = deviceTypeId
+        self.pluginId = PLUGIN_ID
+        self.address = circuit
+        self.pluginProps = Dict(circuitselect=circuit, address=circuit)
+        self.states = dict(states or {})
+        if deviceTypeId == "circuit":
+            self.states.setdefault("onOffState", False)
+        self.writes = 0
+
+    @property
+    def onState(self):
+        return bool(self.states.get("onOffState"))
+
+    @property
+    def heatSetpoint(self):
+        return self.states.get("setpointHeat", 80)
+
+    def updateStatesOnServer(self, changes):
+        self.writes += 1
+        for change in changes:
+            self.states[change['key']] = self.stored(change['key'], change['value'])
+
+    def updateStateOnServer(self, key, value=None):
+        self.writes += 1
+        self.states[key] = self.stored(key, value)
+
+    @staticmethod
+    def stored(key, value):
+        # Indigo keeps a relay's onOffState as a bool, whether it was written as one or as "on"/"off"
+        if key == "onOffState" and not isinstance(value, bool):
+            return str(value).lower() in ("on", "true", "1")
+        return value
+
+    def updateStateImageOnServer(self, image):
+        pass
+
+    def replacePluginPropsOnServer(self, props):
+        self.pluginProps = props
+
+
+class PluginBase(object):
+
+    class StopThread(Exception):
+        pass
+
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion = pluginVersion
+        self.pluginPrefs = pluginPrefs
+        self.logger = logging.getLogger("Plugin")
+        self.debug = False
+        self.stopThread = False
+
+    def sleep(self, seconds):
+        if self.stopThread:
+            raise self.StopThread()
+        time.sleep(seconds)
+
+    def stopConcurrentThread(self):
+        self.stopThread = True
+
+    def errorLog(self, message):
+        self.logger.error(message)
+
+    def getSerialPortUrl(self, props, key):
+        return props.get(key, "")
+
+    def openSerial(self, ownerName, portUrl, baudrate, **kwargs):
+        return serial.serial_for_url(portUrl, baudrate, **kwargs)
+
+    def validateSerialPortUi(self, valuesDict, errorsDict, key):
+        pass
+
+    def deviceUpdated(self, origDev, newDev):
+        pass
+
+    def deviceDeleted(self, dev):
+        pass
+
+
+def makeIndigo():
+    return types.SimpleNamespace(
+        PluginBase=PluginBase,
+        Dict=Dict,
+        devices={},
+        kStateImageSel=types.SimpleNamespace(HvacOff="HvacOff", HvacHeating="HvacHeating"),
+        kDeviceAction=types.SimpleNamespace(TurnOn=1, TurnOff=2, Toggle=3),
+        kThermostatAction=types.SimpleNamespace(SetHvacMode=1, SetHeatSetpoint=2, IncreaseHeatSetpoint=3,
+                                                DecreaseHeatSetpoint=4, RequestStatusAll=5, RequestMode=6,
+                                                RequestEquipmentState=7, RequestTemperatures=8, RequestSetpoints=9),
+    )
+
+
+def loadPlugin(prefs, path=PLUGIN_PATH):
+    # Install a fresh fake 'indigo' and return a Plugin instance built from the plugin source at path.
+    builtins.indigo = makeIndigo()
+    spec = importlib.util.spec_from_file_location("pentair_plugin", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module.Plugin(PLUGIN_ID, "Pentair Pool", "bench", Dict(prefs))
+
+
+def makeDevices(circuits):
+    # A system device, both heaters and the given circuits, registered in the fake indigo.devices.
+    devices = [FakeDevice(1, "System", "system", "SYSTEM"),
+               FakeDevice(2, "Pool Heater", "heater", "POOLHT"),
+               FakeDevice(3, "Spa Heater", "heater", "SPAHT")]
+    for index, circuit in enumerate(circuits):
+        devices.append(FakeDevice(10 + index, circuit.title(), "circuit", circuit))
+    for dev in devices:
+        builtins.indigo.devices[dev.id] = dev
+    return devices
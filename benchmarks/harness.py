@@ -0,0 +1,236 @@
+# Offline benchmark harness: runs the whole plugin on Linux without pool hardware or an Indigo server.
+#
+# - 'indigo' is replaced by fake_indigo
+# - the iLink adapter is a simulated panel on a pseudo-terminal, opened by the plugin through openSerial like a real
+#   serial port; it answers "#CODE = V" / "#CODE ?" commands and can replay recorded traffic
+# - the Autelis web server is a local HTTP stand-in serving the documents in samples/
+#
+# Reports parse throughput, command latency under load and Autelis HTTP fetches per minute, for 1 to 52 circuit
+# devices (AUX1-AUX50 plus POOL and SPA, as offered by genAuxCircuitList).
+#
+#   python benchmarks/harness.py [--seconds N] [path/to/plugin.py]
+
+import argparse
+import http.server
+import logging
+import os
+import re
+import threading
+import time
+
+import fake_indigo
+from bench_ilink_parse import kCircuits, recordedFrames
+
+kSamples = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
+kDeviceCounts = (1, 4, 13, 26, 52)
+kCommandPattern = re.compile(rb"#(\w+)\s*(=\s*(\w+)|\?)")
+
+
+class SimulatedPanel(object):
+    # An iLink adapter on the master side of a pty. The plugin opens the slave side as its serial port.
+
+    def __init__(self, replyDelay=0.0):
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self.replyDelay = replyDelay
+        self.values = {}
+        self.commands = 0
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, frame):
+        os.write(self.master, frame.encode('ascii') + b"\r\n")
+
+    def replay(self, frames):
+        os.write(self.master, b"".join(frame.encode('ascii') + b"\r\n" for frame in frames))
+
+    def run(self):
+        buffer = b""
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b"\r")
+            for line in lines:
+                match = kCommandPattern.search(line)
+                if match is None:
+                    continue
+                self.commands += 1
+                code = match.group(1).decode()
+                if match.group(3) is not None:
+                    self.values[code] = match.group(3).decode()
+                if self.replyDelay:
+                    time.sleep(self.replyDelay)
+                self.send(f"!00 {code} = {self.values.get(code, '0')}")
+
+    def close(self):
+        self.running = False
+        os.close(self.master)
+
+
+class AutelisHandler(http.server.BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        AutelisHandler.requests += 1
+        name = self.path.split("?")[0].lstrip("/")
+        path = os.path.join(kSamples, name)
+        if name.endswith(".xml") and os.path.exists(path):
+            with open(path, "rb") as sample:
+                body = sample.read()
+            etag = f'"{len(body)}-{int(os.path.getmtime(path))}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/xml")
+            self.send_header("ETag", etag)
+        elif name.endswith(".cgi"):
+            body = b"1"
+            self.send_response(200)
+        else:
+            self.send_error(404)
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PluginRun(object):
+    # The plugin started against the simulated hardware, with its concurrent thread running.
+
+    def __init__(self, pluginPath, interface, circuits, serialport, autelisAddress=None, deviceStates=None, **extraPrefs):
+        # the Autelis stand-in's address is a pref, so it is used from the first fetch (the serial port is a pty)
+        prefs = {'interface': interface, 'serialport': serialport, 'autpwd': '', 'statusPoll': '0.05',
+                 'chemPoll': '0.05', 'snapshotAge': '1', 'logTemps': False, 'showDebugInfo': False,
+                 'autelisAddress': autelisAddress}
+        prefs.update(extraPrefs)
+        self.plugin = fake_indigo.loadPlugin(prefs, pluginPath)
+        # the default controller does the I/O (the plugin itself, before controllers existed)
+        self.controller = getattr(self.plugin, "controllers", {0: self.plugin})[0]
+        self.plugin.startup()
+        self.thread = threading.Thread(target=self.plugin.runConcurrentThread, daemon=True)
+        self.thread.start()
+        self.devices = fake_indigo.makeDevices(circuits)
+        for dev in self.devices:
+            # states the server kept from an earlier run
+            dev.states.update((deviceStates or {}).get(dev.id, {}))
+        for dev in self.devices:
+            self.plugin.deviceStartComm(dev)
+
+    def waitForSync(self, limit=30):
+        start = time.time()
+        while self.controller.syncDuration is None and time.time() - start < limit:
+            time.sleep(0.01)
+        return self.controller.syncDuration
+
+    def stop(self):
+        self.plugin.stopConcurrentThread()
+        self.thread.join(5)
+        self.plugin.shutdown()
+
+
+def parseThroughput(pluginPath):
+    panel = SimulatedPanel()
+    run = PluginRun(pluginPath, 'ilink', kCircuits, panel.port)
+    run.waitForSync()
+    frames = recordedFrames() * 20
+    before = run.controller.metrics.counters["serial.frames"]
+    start = time.perf_counter()
+    panel.replay(frames)
+    while run.controller.metrics.counters["serial.frames"] - before < len(frames) and time.perf_counter() - start < 60:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    run.stop()
+    panel.close()
+    print(f"parse throughput: {len(frames)} frames through the pty in {elapsed:.2f} s = {len(frames) / elapsed:,.0f} frames/s")
+
+
+def commandLatency(pluginPath, count):
+    panel = SimulatedPanel(replyDelay=0.002)
+    circuits = kCircuits[:count]
+    run = PluginRun(pluginPath, 'ilink', circuits, panel.port)
+    sync = run.waitForSync()
+    # an "everything on" scene: one command per circuit, all queued at once
+    start = time.perf_counter()
+    for circuit in circuits:
+        run.controller.commQueue.put(circuit + " = 1")
+    while not all(dev.onState for dev in run.devices[3:]) and time.perf_counter() - start < 30:
+        time.sleep(0.001)
+    burst = time.perf_counter() - start
+    lag = run.controller.metrics.percentiles("command.lag")
+    rtt = run.controller.metrics.percentiles("command.roundTrip")
+    run.stop()
+    panel.close()
+    print(f"{count:3} circuits: startup sync {sync * 1000:7.1f} ms, scene of {count} commands done in "
+          f"{burst * 1000:7.1f} ms, queue lag p95 {lag[1] * 1000:6.1f} ms, round trip p95 {rtt[1] * 1000:5.1f} ms")
+
+
+def warmRestart(pluginPath, count):
+    # Restart the plugin a moment after it stopped, with the device states and prefs the server would have kept.
+    panel = SimulatedPanel(replyDelay=0.002)
+    circuits = kCircuits[:count]
+    run = PluginRun(pluginPath, 'ilink', circuits, panel.port)
+    cold = run.waitForSync()
+    coldQueries = panel.commands
+    run.stop()
+    states = {dev.id: dev.states for dev in run.devices}
+    saved = {key: run.plugin.pluginPrefs[key] for key in ("stateSnapshot",) if key in run.plugin.pluginPrefs}
+    run = PluginRun(pluginPath, 'ilink', circuits, panel.port, deviceStates=states, **saved)
+    warm = run.waitForSync()
+    run.stop()
+    panel.close()
+    print(f"{count:3} circuits: cold start {cold * 1000:7.1f} ms, {coldQueries:3} queries; "
+          f"warm restart {warm * 1000:7.1f} ms, {panel.commands - coldQueries:3} queries")
+
+
+def httpFetchRate(pluginPath, count, seconds, push=False):
+    # With push=True the Autelis socket is simulated too, and the plugin runs in push-first mode.
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AutelisHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    AutelisHandler.requests = 0
+    panel = SimulatedPanel() if push else None
+    run = PluginRun(pluginPath, 'autelis', kCircuits[:count], panel.port if push else "",
+                    f"127.0.0.1:{server.server_address[1]}", pushUpdates=push)
+    time.sleep(seconds)
+    requests = AutelisHandler.requests
+    run.stop()
+    server.shutdown()
+    if panel is not None:
+        panel.close()
+    print(f"{count:3} circuits{' (push)' if push else ''}: {requests} Autelis requests in {seconds} s = "
+          f"{requests * 60 / seconds:5.1f} per minute")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10, help="how long to run each HTTP scenario")
+    parser.add_argument("plugin", nargs="?", default=fake_indigo.PLUGIN_PATH, help="plugin.py to benchmark")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    # stand-in for Indigo's event log handler, so plugin messages are written (nowhere) as they would be under Indigo
+    logging.getLogger("Plugin").addHandler(logging.NullHandler())
+    logging.getLogger("Plugin").propagate = False
+
+    parseThroughput(args.plugin)
+    print("command latency under load (panel replies after 2 ms):")
+    for count in kDeviceCounts:
+        commandLatency(args.plugin, count)
+    print("restart to ready (panel replies after 2 ms):")
+    for count in kDeviceCounts:
+        warmRestart(args.plugin, count)
+    print("Autelis HTTP load:")
+    for count in kDeviceCounts:
+        httpFetchRate(args.plugin, count, args.seconds)
+    for count in kDeviceCounts:
+        httpFetchRate(args.plugin, count, args.seconds, push=True)
+
+
+if __name__ == "__main__":
+    main()